@@ -1,28 +1,95 @@
+from array import array
+from itertools import chain
 from random import Random
 
+from grid import SpatialGrid, TorSpatialGrid
 from help import *
+from link import Link
+from sinks import TraceSink
+from stationary import stationary_states
+from stats import PhaseStats
+
+
+class Track:
+    """Points of a car's courses or targets, kept in one flat array('d')
+
+    Reads like the list of (x, y) tuples it replaces (indexing, slicing,
+    iteration, append, extend and deleting a slice), but a point takes 16
+    bytes instead of a tuple and two floats.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, points=()) -> None:
+        self.data: array = array("d", chain.from_iterable(points))
+
+    def __len__(self) -> int:
+        return len(self.data) >> 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return Track(self[j] for j in range(start, stop, step))
+            track = Track()
+            track.data = self.data[2 * start:2 * max(start, stop)]
+            return track
+        n = len(self.data) >> 1
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("track index out of range")
+        return self.data[2 * i], self.data[2 * i + 1]
+
+    def __delitem__(self, i: slice) -> None:
+        start, stop, step = i.indices(len(self))
+        assert step == 1
+        del self.data[2 * start:2 * max(start, stop)]
+
+    def __iter__(self):
+        return zip(self.data[0::2], self.data[1::2])
+
+    def __repr__(self) -> str:
+        return f"Track({list(self)})"
+
+    def numpy(self) -> np.ndarray:
+        """(N, 2) array of the points, a copy"""
+        return np.array(self.data).reshape(-1, 2)
+
+    def append(self, point: (float, float)) -> None:
+        self.data.extend(point)
+
+    def extend(self, points) -> None:
+        self.data.extend(chain.from_iterable(points))
 
 
 class Car:
-    def __init__(self, index: int, seed: float, source_pos: (int, int), targets: [(int, int)] = None) -> None:
+    __slots__ = ("index", "config", "when", "rand", "courses", "targets", "target_idx", "stats")
+
+    def __init__(self, index: int, seed: float, source_pos: (int, int), targets: [(int, int)] = None,
+                 config: Config = None, rand: Random = None) -> None:
         assert 0 <= index
         self.index: int = index
+        self.config: Config = Config() if config is None else config
         self.when: int = 0 if index == 0 else -1
-        self.rand: Random = Random(f"{seed}+{self.index}")
+        # the cars of a simulation share its stream, a car on its own gets its own
+        self.rand: Random = seed_random(seed, index) if rand is None else rand
         if self.index == 0:
             pos: (int, int) = source_pos
         else:
             while True:
-                x_pos: float = self.rand.uniform(0, X_MAX)  # !
-                y_pos: float = self.rand.uniform(0, Y_MAX)
+                x_pos: float = self.rand.uniform(0, self.config.x_max)  # !
+                y_pos: float = self.rand.uniform(0, self.config.y_max)
                 if x_pos != source_pos[0] or y_pos != source_pos[1]:
                     pos = (x_pos, y_pos)
                     break
-        self.courses: [(int, int)] = [pos]
-        self.targets: [(int, int)] = [pos]
+        self.courses: Track = Track([pos])
+        self.targets: Track = Track([pos])
         if targets is not None:
             self.targets.extend(targets)
         self.target_idx: int = 1
+        # PhaseStats that times set_target, set by its simulation after the pre-run
+        self.stats: PhaseStats = None
 
     def set_target(self) -> None:
         assert False, "not implemented"
@@ -30,21 +97,27 @@ class Car:
     def move(self) -> None:
         assert False, "not implemented"
 
+    # these run for every car in every round, so they read the flat arrays directly
     def get_pos(self) -> (int, int):
-        cx = self.courses[-1][0]
-        cy = self.courses[-1][1]
-        return cx, cy
+        courses = self.courses.data
+        return courses[-2], courses[-1]
+
+    def get_prev_pos(self) -> (int, int):
+        """Position before the last move, None if the car has not moved yet"""
+        courses = self.courses.data
+        return (courses[-4], courses[-3]) if len(courses) > 2 else None
 
     def get_target(self) -> (int, int):
-        self.set_target()
-        tx = self.targets[self.target_idx][0]
-        ty = self.targets[self.target_idx][1]
-        return tx, ty
+        if self.stats is None:
+            self.set_target()
+        else:
+            self.stats.set_target(self)
+        i = 2 * self.target_idx
+        return self.targets.data[i], self.targets.data[i + 1]
 
     def get_prev_target(self) -> (int, int):
-        px = self.targets[self.target_idx - 1][0]
-        py = self.targets[self.target_idx - 1][1]
-        return px, py
+        i = 2 * self.target_idx - 2
+        return self.targets.data[i], self.targets.data[i + 1]
 
     def truncate(self) -> None:
         self.set_target()
@@ -52,8 +125,39 @@ class Car:
         self.targets = self.targets[-2:]
         self.target_idx = 1
 
+    def compact(self) -> None:
+        # drop the history but keep the previous position, MG cars need it to not step back
+        # (runs for every car in every round of a streaming run, so it cuts the flat arrays directly)
+        del self.courses.data[:-4]
+        del self.targets.data[:2 * self.target_idx - 2]
+        self.target_idx = 1
+
+    def spawn(self, index: int, seed) -> "Car":
+        """Fresh car of the same model, used to sample its stationary states"""
+        return type(self)(index, seed, (-1, -1), config=self.config)
+
+    def stationary_key(self) -> str:
+        return f"{type(self).__name__}-{self.config.x_max}x{self.config.y_max}"
+
+    def state(self) -> [float]:
+        """Flat state a car needs to continue its trajectory, see warm_start"""
+        assert False, "not implemented"
+
+    def warm_start(self, state: [float]) -> None:
+        assert False, "not implemented"
+
 
 class SynCar(Car):
+    __slots__ = ()
+
+    def state(self) -> [float]:
+        return [*self.get_prev_target(), *self.get_pos(), *self.get_target()]
+
+    def warm_start(self, state: [float]) -> None:
+        self.courses = Track([state[2:4]])
+        self.targets = Track([state[0:2], state[4:6]])
+        self.target_idx = 1
+
     def move(self) -> None:
         step = 1
         while step > 0:
@@ -81,25 +185,36 @@ class SynCar(Car):
 
 
 class SynMGCar(Car):
-    def __init__(self, index, seed, source_pos, targets=None, car_type=1) -> None:
-        super().__init__(index, seed, source_pos, targets)
+    __slots__ = ()
+
+    def __init__(self, index, seed, source_pos, targets=None, car_type=1, config=None, rand=None) -> None:
+        super().__init__(index, seed, source_pos, targets, config, rand)
+        x_max, y_max = self.config.size
         if self.index == 0:
             pos = source_pos
         else:
             while True:
                 if car_type == 1:
-                    x_pos = self.rand.choice([i for i in range(0, X_MAX + 1)])
-                    y_pos = self.rand.choice([i for i in range(0, Y_MAX + 1)])
+                    x_pos = self.rand.choice([i for i in range(0, x_max + 1)])
+                    y_pos = self.rand.choice([i for i in range(0, y_max + 1)])
                 else:
-                    x_pos = self.rand.choice([i for i in range(0, X_MAX)])
-                    y_pos = self.rand.choice([i for i in range(0, Y_MAX)])
+                    x_pos = self.rand.choice([i for i in range(0, x_max)])
+                    y_pos = self.rand.choice([i for i in range(0, y_max)])
                 if x_pos != source_pos[0] or y_pos != source_pos[1]:
                     pos = (x_pos, y_pos)
                     break
-        self.courses = [pos]
-        self.targets = [pos]
+        self.courses = Track([pos])
+        self.targets = Track([pos])
         if targets is not None: self.targets.extend(targets)
 
+    def state(self) -> [float]:
+        return [*(self.get_prev_pos() or self.get_pos()), *self.get_pos()]
+
+    def warm_start(self, state: [float]) -> None:
+        self.courses = Track([state[0:2], state[2:4]])
+        self.targets = Track([state[2:4]])
+        self.target_idx = 1
+
     def move(self) -> None:
         px, py = self.get_prev_target()
         tx, ty = self.get_target()
@@ -108,103 +223,205 @@ class SynMGCar(Car):
         self.courses.append((tx, ty))
 
 
-class Simulation:
-    def __init__(self) -> None:
-        self.cars: [Car] = []
+class BaseSimulation:
+    """State the object engine and the array engines (vec.py) share
+
+    The map topology, the radio link, the message state and the opt-in
+    outputs. `replicas` independent simulations keep their cars back to back.
+    """
+
+    # spatial index used for every range query, set by the map topology
+    grid: type = None
+
+    # the constructor takes the map as an input_images argument
+    needs_heat_maps: bool = False
+
+    # radio link between the cars, see link.Link
+    link_model: type = Link
+
+    def __init__(self, config: Config = None, replicas: int = 1) -> None:
+        self.config: Config = Config() if config is None else config
         self.num_of_broadcasters: [int] = []
         self.neighbor_percentage: [float] = []
+        self.track_neighbors: bool = False
+        # timers and counters per phase, off unless set before simulate()
+        self.stats: PhaseStats = None
+        # visits of the peers to every cell of the map in every round, off unless set before simulate()
+        self.visits: VisitMap = None
+        self.link: Link = self.link_model(self.config)
+        # rounds in a row every car got the message through
+        self.streak: np.ndarray = np.zeros(self.config.num_of_cars * replicas, dtype=np.int64)
+        # (N, M) round every car got each message of config.origins, only with more than the source's one message
+        # a car's `when` is then the round it had all of them
+        self.messages: np.ndarray = None
+
+
+class Simulation(BaseSimulation):
+    def __init__(self, config: Config = None, seed=None) -> None:
+        super().__init__(config)
+        # one stream shared by all cars, they draw from it in a fixed order
+        self.rand: Random = None if seed is None else seed_random(seed)
+        self.cars: [Car] = []
+        # only keep the state needed to continue, the history goes to the sink (if any)
+        self.streaming: bool = False
+        self.sink: TraceSink = None
+        self.rounds: int = 0
+        # informed cars in the order they were informed
+        self.informed: [Car] = []
+        self.uninformed: [Car] = []
+        # the stream of the link's draws, after the cars' ones
+        self.rng: np.random.Generator = np.random.default_rng(child_seed(seed, self.config.num_of_cars))
+
+    def spatial_grid(self, points, groups=None) -> SpatialGrid:
+        return self.grid(points, radius=self.link.radio_range, groups=groups)
 
     def cars_move(self) -> None:
         [car.move() for car in self.cars]
 
+    def contacts(self, cars: [Car], broadcasters: [Car]) -> np.ndarray:
+        """Number of `broadcasters` within range of every one of `cars`"""
+        if not cars or not broadcasters:
+            return np.zeros(len(cars), dtype=np.int64)
+        grid = self.spatial_grid([car.get_pos() for car in broadcasters])
+        return grid.count_within([car.get_pos() for car in cars])
+
     def propagate(self, rd) -> None:
-        assert False, "not implemented"
+        if not self.uninformed:
+            return
+        if self.messages is not None:
+            self.spread(rd)
+            return
+        # one query against every broadcaster, asking the cars informed last round first needs a second grid in
+        # most rounds and is slower at every fleet size
+        contacts = self.contacts(self.uninformed, self.informed)
+        if self.link.instant:
+            hits = contacts > 0
+        else:
+            index = np.fromiter((car.index for car in self.uninformed), dtype=np.int64, count=len(self.uninformed))
+            streak = self.link.transmit(contacts, self.streak[index], self.rng)
+            self.streak[index] = streak
+            hits = self.link.received(streak)
+        uninformed = []
+        for car, hit in zip(self.uninformed, hits):
+            if hit:
+                car.when = rd
+                self.informed.append(car)
+            else:
+                uninformed.append(car)
+        self.uninformed = uninformed
+
+    def start_messages(self) -> None:
+        self.messages = np.full((self.config.num_of_cars, len(self.config.origins)), -1)
+        self.messages[list(self.config.origins), np.arange(len(self.config.origins))] = 0
+        self.streak = np.zeros(self.messages.shape, dtype=np.int64)
+        for car, known in zip(self.cars, (self.messages >= 0).all(axis=1)):
+            car.when = 0 if known else -1
+
+    def spread(self, rd: int) -> None:
+        """propagate for several messages, the contacts of the round are found once for all of them"""
+        positions = [car.get_pos() for car in self.cars]
+        query_idx, point_idx = self.spatial_grid(positions).pairs(positions)
+        self.link.spread(self.messages, self.streak, query_idx, point_idx, self.rng, rd)
+        known = (self.messages >= 0).all(axis=1)
+        informed = [car for car in self.uninformed if known[car.index]]
+        self.uninformed = [car for car in self.uninformed if not known[car.index]]
+        for car in informed:
+            car.when = rd
+        self.informed.extend(informed)
+
+    def message_rounds(self) -> np.ndarray:
+        """Round in which the last car got each message, -1 for the ones that did not reach every car"""
+        messages = np.array([[car.when] for car in self.cars]) if self.messages is None else self.messages
+        return np.where((messages >= 0).all(axis=0), messages.max(axis=0), -1)
 
     def calculate_num_of_broadcasters(self) -> None:
-        num = 0
-        for car in self.cars:
-            if car.when >= 0:
-                num += 1
-        self.num_of_broadcasters.append(num)
+        self.num_of_broadcasters.append(len(self.informed))
 
     def calculate_neighbor_percentage(self) -> None:
-        assert False, "not implemented"
+        positions = [car.get_pos() for car in self.cars]
+        num_of_nbrs = self.spatial_grid(positions).count_within(positions) - 1  # minus itself
+        rates = num_of_nbrs / self.config.num_of_cars
+        self.neighbor_percentage.append(float(rates.sum() / self.config.num_of_cars))
 
-    def simulate(self) -> int:
-        for _ in range(PRE_RUN_COUNT):
+    def end_round(self, rd: int) -> None:
+        self.rounds = rd
+        if self.visits is not None:
+            self.visits.add([car.get_pos() for car in self.cars[1:]])
+        if self.sink is not None:
+            self.sink.write(rd, self.cars)
+        if self.streaming:
+            for car in self.cars:
+                car.compact()
+            del self.num_of_broadcasters[:-1]
+            del self.neighbor_percentage[:-1]
+
+    def warm_up(self) -> None:
+        if self.config.stationary_start:
+            # start every peer somewhere along its model's long-run trajectory, never two in the same state
+            # (they would move in lockstep until their first target)
+            taken: {str: set} = {}
+            for car in self.cars[1:]:
+                states = stationary_states(car)
+                used = taken.setdefault(car.stationary_key(), set())
+                assert len(used) < len(states), "more peers than sampled stationary states"
+                pick = car.rand.randrange(len(states))
+                while pick in used:
+                    pick = car.rand.randrange(len(states))
+                used.add(pick)
+                car.warm_start(states[pick])
+            return
+        for _ in range(self.config.pre_run_count):
             for car in self.cars[1:]:
                 car.move()
+                if self.streaming:
+                    car.compact()
+
+    def simulate(self) -> int:
+        if self.stats is not None:
+            self.stats.instrument(self)
+        self.warm_up()
         for car in self.cars[1:]:
             car.truncate()
+        if self.config.origins != ORIGINS:
+            self.start_messages()
+        self.informed = [car for car in self.cars if car.when >= 0]
+        self.uninformed = [car for car in self.cars if car.when < 0]
         self.calculate_num_of_broadcasters()
-        # self.calculate_neighbor_percentage()  ###
+        if self.track_neighbors:
+            self.calculate_neighbor_percentage()
+        self.end_round(0)
 
         rd = 1
-        while self.num_of_broadcasters[-1] != NUM_OF_CARS:
+        while self.num_of_broadcasters[-1] != self.config.num_of_cars:
             self.cars_move()
             self.propagate(rd)
             self.calculate_num_of_broadcasters()
-            # self.calculate_neighbor_percentage()  ###
-            if not EXCEED_MOVES and rd == NUM_OF_MOVES:
+            if self.track_neighbors:
+                self.calculate_neighbor_percentage()
+            self.end_round(rd)
+            if not self.config.exceed_moves and rd == self.config.num_of_moves:
                 break
             rd += 1
+        if self.stats is not None:
+            self.stats.finish(1, self.rounds)
         return rd
 
     def summary(self) -> ([(int, int)], [(int, int)], int, int):
         courses: [(int, int)] = []
         targets: [(int, int)] = []
+        # the same lists of (x, y) tuples as before the cars kept their points in a Track
         for car in self.cars:
-            courses.append(car.courses)
-            targets.append(car.targets)
+            courses.append(list(car.courses))
+            targets.append(list(car.targets))
         return courses, targets, self.num_of_broadcasters, self.neighbor_percentage
 
 
 class SynSimulation(Simulation):
-    def propagate(self, rd: int) -> None:
-        broadcaster_pos_list = [car.get_pos() for car in self.cars if car.when >= 0]
-        for car in self.cars:
-            if car.when == -1:
-                for pos in broadcaster_pos_list:
-                    dist = get_dist(*pos, *car.get_pos())
-                    if dist <= 1:
-                        car.when = rd
-                        break
-
-    def calculate_neighbor_percentage(self) -> None:
-        rates = []
-        for car in self.cars:
-            num_of_neighbours = -1
-            for c in self.cars:
-                if get_dist(*c.get_pos(), *car.get_pos()) <= 1:
-                    num_of_neighbours += 1
-            rate = num_of_neighbours / NUM_OF_CARS
-            rates.append(rate)
-        self.neighbor_percentage.append((sum(rates) / NUM_OF_CARS))
+    grid = SpatialGrid
 
 
 class TorSynSimulation(Simulation):
-    def propagate(self, rd) -> None:
-        broadcaster_pos_list: [(int, int)] = [car.get_pos() for car in self.cars if car.when >= 0]
-        mod_pos_list: [(int, int)] = list(map(lambda p: (p[0] % X_MAX, p[1] % Y_MAX), broadcaster_pos_list))
-        for car in self.cars:
-            if car.when == -1:
-                car_x, car_y = car.get_pos()
-                car_x, car_y = car_x % X_MAX, car_y % Y_MAX
-                for pos in mod_pos_list:
-                    dist = get_euclidean_dist(*pos, car_x, car_y)
-                    if dist <= 1:
-                        car.when = rd
-                        break
+    grid = TorSpatialGrid
 
-    def calculate_neighbor_percentage(self) -> None:
-        original_positions = [car.get_pos() for car in self.cars]
-        mod_positions = list(map(lambda pos: (pos[0] % X_MAX, pos[1] % Y_MAX), original_positions))
-        rates = []
-        for pos1 in mod_positions:
-            num_of_nbrs = -1  # minus itself
-            for pos2 in mod_positions:
-                if get_euclidean_dist(*pos1, *pos2) <= 1:
-                    num_of_nbrs += 1
-            rate = num_of_nbrs / NUM_OF_CARS
-            rates.append(rate)
-        self.neighbor_percentage.append((sum(rates) / NUM_OF_CARS))
+    def spatial_grid(self, points, groups=None) -> TorSpatialGrid:
+        return self.grid(points, radius=self.link.radio_range, groups=groups, size=self.config.size)
@@ -0,0 +1,177 @@
+import csv
+import os
+import subprocess
+import tracemalloc
+from datetime import datetime
+from time import perf_counter
+
+from main import *
+from stats import PhaseStats
+from vec import VecSimulation
+
+# result columns, one row per model, fleet and map size
+FIELDS = ["version", "date", "model", "cars", "map", "runs", "timeouts", "load_s", "setup_s", "run_s", "rounds",
+          "rounds_per_s", "pre_run_s", "move_s", "propagate_s", "count_s", "other_s", "set_target_s", "targets",
+          "distances", "contacts", "peak_mb"]
+
+# the phases that add up to a run, set_target runs inside move
+PHASES = ["pre_run", "move", "propagate", "count"]
+
+
+def version() -> str:
+    """Commit of the tree being measured, marked -dirty if it has local changes"""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+class Benchmark:
+    """Times simulations of every model over a grid of fleet and map sizes
+
+    Every case runs the same seeds, in the same mode the Runner uses (streaming
+    object simulations, vectorized ones without history), so rows of different
+    versions of the code can be compared one to one.
+
+    :param models: [type]
+        Simulation classes to measure
+    :param num_of_cars: [int]
+        Fleet sizes
+    :param x_max: [int]
+        Map sizes, the maps are square and the source sits in the middle
+    :param heat_maps: [str]
+        Heatmaps of the PG models
+    :param runs: int
+        Simulations per case
+    :param num_of_moves: int
+        Round cap of a run, runs that hit it count as timeouts
+    """
+
+    def __init__(self, models: [type], num_of_cars: [int], x_max: [int], heat_maps: [str] = (), runs: int = 10,
+                 num_of_moves: int = 2000, seed=0) -> None:
+        self.models: [type] = models
+        self.num_of_cars: [int] = num_of_cars
+        self.x_max: [int] = x_max
+        self.heat_maps: [str] = list(heat_maps)
+        self.runs: int = runs
+        self.num_of_moves: int = num_of_moves
+        self.seed = seed
+
+    def make(self, model: type, seed, config: Config):
+        source_pos = tuple(size // 2 for size in config.size)
+        args = (self.heat_maps,) if model.needs_heat_maps else ()
+        simulation = model(seed, source_pos, None, *args, config=config)
+        if isinstance(simulation, VecSimulation):
+            simulation.record = False
+        else:
+            simulation.streaming = True
+        return simulation
+
+    def measure(self, model: type, num_of_cars: int, x_max: int) -> dict:
+        config = Config(x_max, num_of_cars=num_of_cars, num_of_moves=self.num_of_moves)
+        load = 0.0
+        if model.needs_heat_maps:
+            # what a cold worker pays before its first run, the runs themselves use the cached samplers
+            start = perf_counter()
+            for heat_map in self.heat_maps:
+                HeatmapSampler(read_heatmap(heat_map))
+            load = perf_counter() - start
+            for heat_map in self.heat_maps:
+                load_sampler(heat_map)
+
+        stats = PhaseStats()
+        setup = run = 0.0
+        rounds = timeouts = 0
+        for i in range(self.runs):
+            start = perf_counter()
+            simulation = self.make(model, child_seed(self.seed, i), config)
+            setup += perf_counter() - start
+            simulation.stats = stats
+            start = perf_counter()
+            simulation.simulate()
+            run += perf_counter() - start
+            # the rounds each replica ran, not simulate()'s return value, which differs between the engines
+            done = np.atleast_1d(simulation.rounds)
+            rounds += int(done.sum())
+            timeouts += int((done >= self.num_of_moves).sum())
+
+        # peak memory of one run, measured apart since tracemalloc slows everything down
+        tracemalloc.start()
+        self.make(model, child_seed(self.seed, 0), config).simulate()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        row = {"model": model.__name__, "cars": num_of_cars, "map": f"{x_max}x{x_max}", "runs": self.runs,
+               "timeouts": timeouts, "load_s": load, "setup_s": setup / self.runs, "run_s": run / self.runs,
+               "rounds": rounds / self.runs, "rounds_per_s": rounds / run, "peak_mb": peak / 1e6}
+        for phase in PHASES + ["set_target"]:
+            row[f"{phase}_s"] = stats.seconds.get(phase, 0.0) / self.runs
+        row["other_s"] = row["run_s"] - sum(row[f"{phase}_s"] for phase in PHASES)
+        for name in ("targets", "distances", "contacts"):
+            row[name] = stats.counts.get(name, 0) / self.runs
+        return row
+
+    def run(self, path: str = None) -> [dict]:
+        """Measure every case, appending each row to the CSV at `path` (if given) as soon as it is done"""
+        rows = []
+        stamp = {"version": version(), "date": datetime.now().isoformat(timespec="seconds")}
+        file = None
+        if path is not None:
+            new = not os.path.exists(path) or os.path.getsize(path) == 0
+            file = open(path, "a", newline="")
+            writer = csv.DictWriter(file, FIELDS)
+            if new:
+                writer.writeheader()
+        try:
+            for model in self.models:
+                for num_of_cars in self.num_of_cars:
+                    for x_max in self.x_max:
+                        row = {**stamp, **self.measure(model, num_of_cars, x_max)}
+                        print(f"{row['model']} cars={num_of_cars} map={row['map']}: "
+                              f"{row['rounds_per_s']:.0f} rounds/s, setup {row['setup_s'] * 1e3:.2f}ms, "
+                              f"peak {row['peak_mb']:.2f}MB")
+                        rows.append(row)
+                        if file is not None:
+                            writer.writerow({key: round(value, 6) if isinstance(value, float) else value
+                                             for key, value in row.items()})
+                            file.flush()
+        finally:
+            if file is not None:
+                file.close()
+        return rows
+
+
+def compare(path: str, old: str, new: str) -> None:
+    """Print the rounds/s of version `new` relative to `old` for every case both have measured"""
+    with open(path, newline="") as file:
+        rows = list(csv.DictReader(file))
+    # the last measurement of a version wins
+    speed = {}
+    for row in rows:
+        speed[row["version"], row["model"], row["cars"], row["map"]] = float(row["rounds_per_s"])
+    for (version_, model, cars, size), rate in speed.items():
+        if version_ == new and (old, model, cars, size) in speed:
+            print(f"{model} cars={cars} map={size}: {rate / speed[old, model, cars, size]:.2f}x")
+
+
+if __name__ == '__main__':
+    MODELS = [RWP2DSimulation, RWP3DSimulation, RDSimulation, MG2DSimulation, MG3DSimulation, PG2DSimulation,
+              VecRWP2DSimulation, VecRWP3DSimulation, VecRDSimulation, VecMG2DSimulation, VecMG3DSimulation,
+              VecPG2DSimulation, EventRWP2DSimulation, EventRWP3DSimulation, EventRDSimulation]
+    NUM_OF_CARS_GRID = [10, 25, 50]
+    X_MAX_GRID = [25, 50]
+    HEAT_MAPS = ["./heatmaps/4-circles/left-top.jpg",
+                 "./heatmaps/4-circles/left-bottom.jpg",
+                 "./heatmaps/4-circles/right-top.jpg",
+                 "./heatmaps/4-circles/right-bottom.jpg"]
+    RUNS = 10
+    # Rows are appended, every version of the code that is measured adds its own
+    RESULTS = "./bench.csv"
+    # Set to an earlier version in RESULTS to print the speedup of this one against it
+    BASELINE = None
+
+    benchmark = Benchmark(MODELS, NUM_OF_CARS_GRID, X_MAX_GRID, HEAT_MAPS, runs=RUNS)
+    benchmark.run(RESULTS)
+    if BASELINE is not None:
+        compare(RESULTS, BASELINE, version())
@@ -0,0 +1,140 @@
+import os
+import tempfile
+
+from main import *
+from sinks import BinaryTraceSink, TraceFile, TraceSink
+
+
+def mirrored(simulation):
+    """Let every peer of a vectorized `simulation` head for the mirror image of where it is
+
+    The draws no longer use the generator, so a round engine and the event
+    engine built with the same seed move their cars along the very same paths.
+    """
+
+    size = np.array(simulation.config.size, dtype=float)
+    simulation.draw_targets = lambda idx: size - simulation.pos[idx]
+    return simulation
+
+
+def check_event_engine(models: [(type, type)], seeds: int = 5, replicas: int = 4) -> None:
+    """On the same paths the event engine informs every car no later than the round engine
+
+    It finds the contacts of the round engine and the ones between rounds.
+    """
+
+    config = Config(30, num_of_cars=25, pre_run_count=5, exceed_moves=True)
+    for vec_class, event_class in models:
+        for seed in range(seeds):
+            rounds, event = [mirrored(model(seed, (15, 15), [(15, 0), (15, 30)], replicas=replicas, config=config))
+                             for model in (vec_class, event_class)]
+            rounds.simulate()
+            event.simulate()
+            late = np.flatnonzero(event.when > rounds.when)
+            assert not late.size, f"{event_class.__name__} seed {seed}: cars {late} informed later than by the rounds"
+
+
+def check_source_off_map() -> None:
+    """A source that leaves the map still informs the peers it passes, in both engines"""
+    config = Config(50, num_of_cars=2, pre_run_count=0, num_of_moves=500)
+    found = []
+    for model in (VecRWP2DSimulation, EventRWP2DSimulation):
+        simulation = model(1, (25, -40), [(25, 1000)], config=config)
+        simulation.pos[1] = simulation.prev[1] = (25, 45)
+        simulation.draw_targets = lambda idx: np.tile([25.0, 0.0], (idx.size, 1))
+        simulation.simulate()
+        found.append(int(simulation.rounds[0]))
+    assert found[0] < config.num_of_moves, f"the round engine never informed the peer: {found}"
+    assert found[1] <= found[0], f"the event engine informed the peer later than the round engine: {found}"
+
+
+def check_vec_engine(models: [(type, type)], runs: int = 300, z: float = 4.0) -> None:
+    """The object engine and its vectorized counterpart need the same rounds on average
+
+    They draw from different streams, so only the means are compared, within
+    `z` standard errors of their difference.
+    """
+
+    config = Config(30, num_of_cars=20, exceed_moves=True)
+    for object_class, vec_class in models:
+        found = []
+        for seed in range(runs):
+            simulation = object_class(seed, (15, 15), None, config=config)
+            simulation.streaming = True
+            simulation.simulate()
+            found.append(simulation.rounds)
+        simulation = vec_class(0, (15, 15), None, replicas=runs, config=config)
+        simulation.record = False
+        simulation.simulate()
+        rounds = [np.array(found, dtype=float), simulation.rounds.astype(float)]
+        error = np.sqrt(sum(r.var(ddof=1) / r.size for r in rounds))
+        means = [r.mean() for r in rounds]
+        assert abs(means[0] - means[1]) < z * error, \
+            f"{object_class.__name__} needs {means[0]:.1f} rounds, {vec_class.__name__} {means[1]:.1f}"
+
+
+class MemorySink(TraceSink):
+    """Every car's position in every round, kept in memory"""
+
+    def __init__(self) -> None:
+        self.positions: [[(float, float)]] = []
+        self.when: [int] = []
+
+    def write(self, rd: int, cars: list) -> None:
+        self.positions.append([car.get_pos() for car in cars])
+        self.when = [car.when for car in cars]
+
+
+def check_trace() -> None:
+    """A BinaryTraceSink file reads back the positions and `when` of the run that wrote it"""
+    config = Config(30, num_of_cars=15, num_of_moves=150)
+    expected = MemorySink()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.bin")
+        # a chunk size that does not divide the rounds, so the last chunk is a partial one
+        for sink in (expected, BinaryTraceSink(path, chunk=7)):
+            simulation = RWP2DSimulation(0, (15, 15), None, config=config)
+            simulation.streaming = True
+            with sink:
+                simulation.sink = sink
+                simulation.simulate()
+        positions = np.array(expected.positions, dtype=np.float32)
+        with TraceFile(path) as trace:
+            assert len(trace) == len(positions) == simulation.rounds + 1
+            assert list(trace.when) == expected.when
+            for rd in range(len(trace)):
+                assert np.array_equal(trace.positions(rd), positions[rd])
+            for index in range(config.num_of_cars):
+                assert np.array_equal(trace.courses(index), positions[:, index])
+
+
+def check_sampler(draws: int = 200000, z: float = 5.0) -> None:
+    """HeatmapSampler draws every cell as often as the heatmap says, and never an empty one"""
+    rng = np.random.default_rng(0)
+    weights = rng.random((10, 10)) ** 3
+    weights[rng.random((10, 10)) < 0.2] = 0
+    matrix = np.asmatrix(weights / weights.sum())
+    sampler = HeatmapSampler(matrix)
+    p = np.asarray(matrix).ravel()
+    # batches from a NumPy generator, single draws from a car's random.Random
+    rand = seed_random(0)
+    for found, amount in ((sampler.draw(rng, draws), draws),
+                          (np.array([sampler.draw(rand) for _ in range(draws // 10)]), draws // 10)):
+        counts = np.bincount(found, minlength=p.size)
+        assert not counts[p == 0].any(), "drew a cell of weight 0"
+        error = np.sqrt(amount * p * (1 - p))
+        assert (np.abs(counts - amount * p) <= z * error + 1).all(), "cell frequencies off the heatmap"
+
+
+if __name__ == '__main__':
+    # Pairs of engines that run the same mobility model
+    EVENT_MODELS = [(VecRWP2DSimulation, EventRWP2DSimulation), (VecRDSimulation, EventRDSimulation),
+                    (VecRWP3DSimulation, EventRWP3DSimulation)]
+    VEC_MODELS = [(RWP2DSimulation, VecRWP2DSimulation), (RWP3DSimulation, VecRWP3DSimulation),
+                  (RDSimulation, VecRDSimulation), (MG2DSimulation, VecMG2DSimulation),
+                  (MG3DSimulation, VecMG3DSimulation)]
+
+    for check, args in ((check_event_engine, (EVENT_MODELS,)), (check_source_off_map, ()),
+                        (check_vec_engine, (VEC_MODELS,)), (check_trace, ()), (check_sampler, ())):
+        check(*args)
+        print(f"{check.__name__}: ok")
@@ -0,0 +1,219 @@
+import itertools
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import Client, Listener
+
+# environment variable with the shared secret of the coordinator and its workers
+AUTHKEY_VAR = "CARS_AUTHKEY"
+PORT = 5123
+
+
+def get_authkey(authkey: bytes = None) -> bytes:
+    """The given secret, or else the one in $CARS_AUTHKEY
+
+    Both sides unpickle what the other sends, so whoever knows the secret and can reach the port can run code
+    on the coordinator and on every worker. There is no default, a missing secret is an error.
+    """
+
+    if authkey is None:
+        authkey = os.environ.get(AUTHKEY_VAR, "").encode()
+    if not authkey:
+        raise ValueError(f"no authkey given, set {AUTHKEY_VAR} to a secret shared by the coordinator and its workers")
+    return authkey
+
+
+class Coordinator:
+    """Hands out batches to worker processes on any host, in place of the process pool of a Runner or Sweep
+
+    Workers (see work()) connect over TCP, take one batch at a time and send
+    back its result. A busy worker sends a heartbeat every lease / 3 seconds, a
+    worker that disconnects or stays silent for `lease` seconds is taken to be
+    gone and its batch is handed to the next worker that asks. If the first
+    worker turns up with a result after all, the batch is only counted once
+    (both results are the same, the runs are seeded).
+
+    The tasks are unpickled by the workers, so they must run the same code,
+    from a directory with the same heatmap paths, as the coordinator. The
+    results are unpickled by the coordinator, so only listen on an address
+    that is reachable from a trusted network.
+
+    :param address: (str, int)
+        Address to listen on, only this host by default
+    :param authkey: bytes
+        Secret the workers must know, $CARS_AUTHKEY if None
+    :param lease: float
+        Seconds a busy worker may stay silent
+    """
+
+    def __init__(self, address: (str, int) = ("127.0.0.1", PORT), authkey: bytes = None, lease: float = 30.0) -> None:
+        self.lease: float = lease
+        # batches that are not done yet, by id, and the ones of them no worker holds
+        self.jobs: {int: tuple} = {}
+        self.pending: deque = deque()
+        self.ids = itertools.count()
+        self.changed = threading.Condition()
+        self.closed: bool = False
+        self.listener: Listener = Listener(address, authkey=get_authkey(authkey))
+        self.address: (str, int) = self.listener.address
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def apply_async(self, func, args: tuple = (), callback=None, error_callback=None) -> None:
+        """Queue func(*args) like Pool.apply_async, the callback gets its result from whichever worker ran it"""
+        with self.changed:
+            assert not self.closed, "coordinator is closed"
+            batch = next(self.ids)
+            self.jobs[batch] = (func, args, callback, error_callback)
+            self.pending.append(batch)
+            self.changed.notify()
+
+    def take(self) -> (int, tuple):
+        """Next batch for a worker, waits for one to be queued, None once closed"""
+        with self.changed:
+            while not self.closed:
+                while self.pending:
+                    batch = self.pending.popleft()
+                    # a handed back batch may have been finished by its first worker in the meantime
+                    if batch in self.jobs:
+                        return batch, self.jobs[batch]
+                self.changed.wait()
+        return None
+
+    def requeue(self, batch: int) -> None:
+        with self.changed:
+            if batch in self.jobs:
+                self.pending.appendleft(batch)
+                self.changed.notify()
+
+    def finish(self, batch: int) -> tuple:
+        with self.changed:
+            return self.jobs.pop(batch, None)
+
+    def accept(self) -> None:
+        while True:
+            try:
+                connection = self.listener.accept()
+            except mp.AuthenticationError:
+                continue
+            except OSError:
+                return  # closed
+            threading.Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+    def serve(self, connection) -> None:
+        """Answer the requests of one worker, until it leaves or goes silent"""
+        batch = None
+        try:
+            while True:
+                connection.recv()  # ("take",)
+                job = self.take()
+                if job is None:
+                    connection.send(("stop",))
+                    return
+                batch, (func, args, _, _) = job
+                connection.send(("batch", batch, func, args, self.lease / 3))
+                while True:
+                    if not connection.poll(self.lease):
+                        return
+                    message = connection.recv()
+                    if message[0] != "alive":
+                        break
+                kind, _, result = message
+                job = self.finish(batch)
+                batch = None
+                if job is not None:
+                    callback = job[2] if kind == "done" else job[3]
+                    if callback is not None:
+                        callback(result)
+        except (EOFError, OSError):
+            pass
+        finally:
+            if batch is not None:
+                self.requeue(batch)
+            connection.close()
+
+    def close(self) -> None:
+        """Stop handing out batches, the ones still queued are dropped and idle workers exit"""
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+        self.listener.close()
+
+    terminate = close
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def work(address: (str, int), authkey: bytes = None, patience: float = 60.0) -> None:
+    """Run batches of the Coordinator at `address` until it closes
+
+    Waits up to `patience` seconds for the coordinator to come up. The secret
+    is taken from $CARS_AUTHKEY if `authkey` is None.
+    """
+
+    authkey = get_authkey(authkey)
+    start = time.time()
+    while True:
+        try:
+            connection = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.time() - start > patience:
+                raise
+            time.sleep(1)
+
+    # the heartbeat and the result share the connection
+    sending = threading.Lock()
+
+    def beat(done: threading.Event, interval: float) -> None:
+        while not done.wait(interval):
+            try:
+                with sending:
+                    connection.send(("alive",))
+            except OSError:
+                return  # the coordinator gave up on this worker, sending the result will tell
+
+    with connection:
+        while True:
+            try:
+                connection.send(("take",))
+                message = connection.recv()
+            except (EOFError, OSError):
+                return
+            if message[0] == "stop":
+                return
+            _, batch, func, args, interval = message
+            done = threading.Event()
+            heartbeat = threading.Thread(target=beat, args=(done, interval), daemon=True)
+            heartbeat.start()
+            try:
+                result = ("done", batch, func(*args))
+            except Exception as error:
+                result = ("error", batch, error)
+            done.set()
+            heartbeat.join()
+            try:
+                connection.send(result)
+            except (EOFError, OSError):
+                return
+            except Exception as error:
+                # the result or exception could not be pickled
+                connection.send(("error", batch, RuntimeError(repr(error))))
+
+
+if __name__ == '__main__':
+    # CARS_AUTHKEY=... python cluster.py HOST[:PORT] [PROCESSES], from the repository root of every worker host
+    host, _, port = sys.argv[1].partition(":")
+    authkey = get_authkey()  # fail here rather than in every worker
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else mp.cpu_count()
+    workers = [mp.Process(target=work, args=((host, int(port or PORT)), authkey)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
@@ -0,0 +1,151 @@
+import numpy as np
+
+from help import X_MAX, Y_MAX
+
+
+class SpatialGrid:
+    """Uniform-cell spatial hash over a set of 2D points
+
+    Cells are at least `radius` wide, so every point within `radius` of a query
+    lies in the query's own cell or one of the eight cells around it. Building
+    the grid is one sort, a query is a handful of binary searches.
+
+    Points and queries may carry integer `groups` (e.g. the replica a car
+    belongs to), pairs are then only formed within the same group.
+
+    Small queries (at most `brute_force` query-point combinations, e.g. the
+    last few uninformed cars of a run) just compare every pair, the hash is
+    only built once a query needs it.
+    """
+
+    offsets: np.ndarray = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+    brute_force: int = 1024
+    # PhaseStats that counts the distance evaluations and contacts of every query, if any
+    stats = None
+
+    def __init__(self, points, radius: float = 1, groups=None) -> None:
+        self.radius: float = radius
+        self.points: np.ndarray = self.normalize(np.asarray(points, dtype=float).reshape(-1, 2))
+        self.groups: np.ndarray = self.group_ids(groups, len(self.points))
+        self.order: np.ndarray = None
+        self.sorted_keys: np.ndarray = None
+
+    def build(self) -> None:
+        cells = self.cells(self.points)
+        self.set_bounds(cells)
+        keys = self.keys(cells, self.groups)
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    @staticmethod
+    def group_ids(groups, size: int) -> np.ndarray:
+        if groups is None:
+            return np.zeros(size, dtype=np.int64)
+        return np.asarray(groups, dtype=np.int64)
+
+    def normalize(self, points: np.ndarray) -> np.ndarray:
+        return points
+
+    def cells(self, points: np.ndarray) -> np.ndarray:
+        return np.floor(points / self.radius).astype(np.int64)
+
+    def set_bounds(self, cells: np.ndarray) -> None:
+        if cells.size:
+            self.low, self.high = cells.min(axis=0), cells.max(axis=0)
+        else:
+            self.low, self.high = np.zeros(2, dtype=np.int64), np.full(2, -1, dtype=np.int64)
+
+    def neighbor_cells(self, cells: np.ndarray) -> np.ndarray:
+        return cells[:, None, :] + self.offsets[None, :, :]
+
+    def keys(self, cells: np.ndarray, groups: np.ndarray) -> np.ndarray:
+        # cells outside the occupied block can't hold any point, mark them with -1
+        inside = ((cells >= self.low) & (cells <= self.high)).all(axis=-1)
+        rel = cells - self.low
+        span = self.high - self.low + 1
+        keys = (groups * span[0] + rel[..., 0]) * span[1] + rel[..., 1]
+        return np.where(inside, keys, -1)
+
+    def distances(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        delta = a - b
+        return np.sqrt((delta ** 2).sum(axis=-1))
+
+    def pairs(self, queries, groups=None) -> (np.ndarray, np.ndarray):
+        """Find every (query, point) pair that lies within `radius`
+
+        :param queries: array-like of shape (Q, 2)
+        :param groups: optional group of every query
+        :return: index arrays into the queries and into the grid's points
+        """
+
+        queries = self.normalize(np.asarray(queries, dtype=float).reshape(-1, 2))
+        groups = self.group_ids(groups, len(queries))
+        if len(queries) * len(self.points) <= self.brute_force:
+            close = self.distances(queries[:, None, :], self.points[None, :, :]) <= self.radius
+            close &= groups[:, None] == self.groups[None, :]
+            if self.stats is not None:
+                self.stats.count("distances", close.size)
+                self.stats.count("contacts", np.count_nonzero(close))
+            return np.nonzero(close)
+
+        if self.order is None:
+            self.build()
+        keys = self.keys(self.neighbor_cells(self.cells(queries)), groups[:, None]).ravel()
+        lo = np.searchsorted(self.sorted_keys, keys, "left")
+        hi = np.searchsorted(self.sorted_keys, keys, "right")
+        counts = np.where(keys >= 0, hi - lo, 0)
+        total = counts.sum()
+
+        # expand every [lo, hi) range of the sorted keys into candidate pairs
+        query_idx = np.repeat(np.arange(keys.size) // len(self.offsets), counts)
+        starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+        point_idx = self.order[starts + np.arange(total)]
+
+        close = self.distances(queries[query_idx], self.points[point_idx]) <= self.radius
+        if self.stats is not None:
+            self.stats.count("distances", total)
+            self.stats.count("contacts", np.count_nonzero(close))
+        return query_idx[close], point_idx[close]
+
+    def any_within(self, queries, groups=None) -> np.ndarray:
+        query_idx, _ = self.pairs(queries, groups)
+        hit = np.zeros(len(queries), dtype=bool)
+        hit[query_idx] = True
+        return hit
+
+    def count_within(self, queries, groups=None) -> np.ndarray:
+        query_idx, _ = self.pairs(queries, groups)
+        return np.bincount(query_idx, minlength=len(queries))
+
+
+class TorSpatialGrid(SpatialGrid):
+    """SpatialGrid on a torus of `size` (X_MAX x Y_MAX by default), positions and distances wrap around"""
+
+    def __init__(self, points, radius: float = 1, groups=None, size: (float, float) = (X_MAX, Y_MAX)) -> None:
+        self.size: np.ndarray = np.array(size, dtype=float)
+        self.num_of_cells: np.ndarray = np.maximum((self.size // radius).astype(np.int64), 1)
+        # on tiny maps the -1 and +1 neighbour are the same cell, visit it only once
+        steps = [sorted({dx % n for dx in (-1, 0, 1)}) for n in self.num_of_cells]
+        self.offsets = np.array([(dx, dy) for dx in steps[0] for dy in steps[1]])
+        super().__init__(points, radius, groups)
+
+    def normalize(self, points: np.ndarray) -> np.ndarray:
+        return points % self.size
+
+    def cells(self, points: np.ndarray) -> np.ndarray:
+        cells = np.floor(points / (self.size / self.num_of_cells)).astype(np.int64)
+        return np.minimum(cells, self.num_of_cells - 1)
+
+    def set_bounds(self, cells: np.ndarray) -> None:
+        pass
+
+    def neighbor_cells(self, cells: np.ndarray) -> np.ndarray:
+        return (cells[:, None, :] + self.offsets[None, :, :]) % self.num_of_cells
+
+    def keys(self, cells: np.ndarray, groups: np.ndarray) -> np.ndarray:
+        return (groups * self.num_of_cells[0] + cells[..., 0]) * self.num_of_cells[1] + cells[..., 1]
+
+    def distances(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        delta = np.abs(a - b)
+        delta = np.minimum(delta, self.size - delta)
+        return np.sqrt((delta ** 2).sum(axis=-1))
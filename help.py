@@ -1,7 +1,9 @@
+import hashlib
 import math
+import os
+from random import Random
 
 import numpy as np
-from PIL import Image
 
 X_MAX = 50
 Y_MAX = X_MAX
@@ -9,6 +11,13 @@ NUM_OF_CARS = 25
 NUM_OF_MOVES = 100000
 PRE_RUN_COUNT = 100
 EXCEED_MOVES = False
+STATIONARY_START = False
+# radio link between cars, see link.Link
+RADIO_RANGE = 1
+DELIVERY = 1.0
+TRANSMIT_ROUNDS = 1
+# cars that start a message each, the single message of the source by default
+ORIGINS = (0,)
 
 fig_size = (7, 7)
 
@@ -18,29 +27,124 @@ assert 1 < NUM_OF_CARS  # We need at least one car next to the source car
 assert 0 < NUM_OF_MOVES
 
 
+class Config:
+    """Settings of one simulation, the module constants above are the defaults
+
+    Passed to every Simulation (and from there to its cars), so a sweep can run
+    maps and fleets of different sizes in one interpreter.
+    """
+
+    def __init__(self, x_max: int = X_MAX, y_max: int = None, num_of_cars: int = NUM_OF_CARS,
+                 num_of_moves: int = NUM_OF_MOVES, pre_run_count: int = PRE_RUN_COUNT,
+                 exceed_moves: bool = EXCEED_MOVES, stationary_start: bool = STATIONARY_START,
+                 radio_range: float = RADIO_RANGE, delivery: float = DELIVERY,
+                 transmit_rounds: int = TRANSMIT_ROUNDS, origins: (int,) = ORIGINS) -> None:
+        self.x_max: int = x_max
+        self.y_max: int = x_max if y_max is None else y_max
+        self.num_of_cars: int = num_of_cars
+        self.num_of_moves: int = num_of_moves
+        self.pre_run_count: int = pre_run_count
+        self.exceed_moves: bool = exceed_moves
+        # draw the peers' starting state from the model's stationary distribution instead of the pre-run
+        self.stationary_start: bool = stationary_start
+        # distance a car reaches, chance that a contact gets the message through in a round
+        # and rounds in a row it takes to transmit it
+        self.radio_range: float = radio_range
+        self.delivery: float = delivery
+        self.transmit_rounds: int = transmit_rounds
+        # one message per entry, spread over the same mobility at once, see Simulation.messages
+        self.origins: (int,) = tuple(origins)
+        assert 0 < self.x_max
+        assert 0 < self.y_max
+        assert 1 < self.num_of_cars  # We need at least one car next to the source car
+        assert 0 < self.num_of_moves
+        assert 0 < self.radio_range
+        assert 0 < self.delivery <= 1
+        assert 0 < self.transmit_rounds
+        assert self.origins and all(0 <= origin < self.num_of_cars for origin in self.origins)
+
+    @property
+    def size(self) -> (int, int):
+        return self.x_max, self.y_max
+
+    def __str__(self) -> str:
+        return (f"cars={self.num_of_cars} map={self.x_max}x{self.y_max} moves={self.num_of_moves}"
+                f"{'+' if self.exceed_moves else ''} "
+                f"{'stationary' if self.stationary_start else f'pre_run={self.pre_run_count}'}"
+                # only the link settings that differ from the instant, lossless unit range
+                f"{f' range={self.radio_range}' if self.radio_range != RADIO_RANGE else ''}"
+                f"{f' delivery={self.delivery}' if self.delivery != DELIVERY else ''}"
+                f"{f' transmit={self.transmit_rounds}' if self.transmit_rounds != TRANSMIT_ROUNDS else ''}"
+                f"{f' origins={list(self.origins)}' if self.origins != ORIGINS else ''}")
+
+
 def get_dist(x1, y1, x2, y2):
     dist = math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
     return dist
 
 
-def get_euclidean_dist(x1, y1, x2, y2):
-    comp1 = min(abs(x1 - x2), X_MAX - abs(x1 - x2)) ** 2
-    comp2 = min(abs(y1 - y2), Y_MAX - abs(y1 - y2)) ** 2
+def get_euclidean_dist(x1, y1, x2, y2, size=(X_MAX, Y_MAX)):
+    comp1 = min(abs(x1 - x2), size[0] - abs(x1 - x2)) ** 2
+    comp2 = min(abs(y1 - y2), size[1] - abs(y1 - y2)) ** 2
     return math.sqrt(comp1 + comp2)
 
 
-def unzip(courses, mod):
+def unzip(courses, mod, size=(X_MAX, Y_MAX)):
     xys = list(zip(*courses))
     if mod:
-        xs = list(map(lambda x: x % X_MAX, list(xys[0])))
-        ys = list(map(lambda y: y % Y_MAX, list(xys[1])))
+        xs = list(map(lambda x: x % size[0], list(xys[0])))
+        ys = list(map(lambda y: y % size[1], list(xys[1])))
     else:
         xs = list(map(lambda x: x, list(xys[0])))
         ys = list(map(lambda y: y, list(xys[1])))
     return xs, ys
 
 
-def load_heatmap(input_image: str) -> np.matrix:
+def split_evenly(total: int, parts: int) -> [int]:
+    chunks = [total // parts for _ in range(parts)]
+    for j in range(total % parts):
+        chunks[j] += 1
+    return chunks
+
+
+def seed_sequence(seed) -> np.random.SeedSequence:
+    """Turn a seed into a NumPy SeedSequence
+
+    Accepts a SeedSequence, an int, a string written by format_seed (so a logged
+    run can be replayed exactly) or any other string, which is hashed.
+    """
+
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, str):
+        entropy, *spawn_key = seed.split("/")
+        if entropy.isdigit() and all(key.isdigit() for key in spawn_key):
+            return np.random.SeedSequence(int(entropy), spawn_key=tuple(map(int, spawn_key)))
+        seed = int.from_bytes(hashlib.sha256(seed.encode()).digest()[:16], "little")
+    return np.random.SeedSequence(seed)
+
+
+def child_seed(seed, *key: int) -> np.random.SeedSequence:
+    """Independent stream `key` below `seed`, e.g. a run of a sweep or a car of a run
+
+    Unlike SeedSequence.spawn the child only depends on its key, not on how
+    many children were made before, so any of them can be rebuilt on its own.
+    """
+
+    seed = seed_sequence(seed)
+    return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + key, pool_size=seed.pool_size)
+
+
+def seed_random(seed, *key: int) -> Random:
+    """random.Random on stream `key` below `seed`, see child_seed"""
+    return Random(int(child_seed(seed, *key).generate_state(1, np.uint64)[0]))
+
+
+def format_seed(seed: np.random.SeedSequence) -> str:
+    return "/".join(map(str, (seed.entropy, *seed.spawn_key)))
+
+
+def read_heatmap(input_image: str) -> np.matrix:
     """Convert input image into matrix of probabilities
 
     If none is given, will raise a FileNotFoundError
@@ -53,6 +157,9 @@ def load_heatmap(input_image: str) -> np.matrix:
     if input_image is None:
         raise FileNotFoundError('Missing input file for probability grid')
 
+    # only decoding a heatmap needs PIL, the simulations themselves don't import it
+    from PIL import Image
+
     # Open image, and convert to grayscale
     image = Image.open(input_image).convert('L')
 
@@ -64,6 +171,160 @@ def load_heatmap(input_image: str) -> np.matrix:
     return image_matrix / image_matrix.sum()
 
 
+def save_array(path: str, array: np.ndarray) -> None:
+    """Write `array` to the `.npy` file at `path`
+
+    Written to a private file first and then moved into place, so other
+    workers that read or write the same file at once never see half of it.
+    """
+
+    partial = f"{path}.{os.getpid()}"
+    with open(partial, "wb") as file:
+        np.save(file, array)
+    os.replace(partial, path)
+
+
+def read_sidecar(input_image: str) -> np.matrix:
+    """Memory-map the `.npy` copy of a heatmap, writing it first if it is missing or stale"""
+    sidecar = f"{input_image}.npy"
+    if not os.path.exists(sidecar) or os.path.getmtime(sidecar) < os.path.getmtime(input_image):
+        save_array(sidecar, np.asarray(read_heatmap(input_image)))
+    return np.asmatrix(np.load(sidecar, mmap_mode="r"))
+
+
+_heatmaps: {(str, float): np.matrix} = {}
+_samplers: {(str, float): "HeatmapSampler"} = {}
+
+
+def heatmap_key(input_image: str) -> (str, float):
+    if input_image is None:
+        raise FileNotFoundError('Missing input file for probability grid')
+    return os.path.abspath(input_image), os.path.getmtime(input_image)
+
+
+def load_heatmap(input_image: str, sidecar: bool = False) -> np.matrix:
+    """Cached, read-only version of read_heatmap
+
+    Every image is decoded once per process (keyed by path and mtime, so an
+    edited image is picked up again). Load the heatmaps before forking worker
+    processes and they all share the same copy. With `sidecar` the grid is
+    memory-mapped from an `.npy` file next to the image instead, which also
+    shares it between processes that were not forked from each other.
+
+    :param input_image: str
+        Path to image to be converted
+    :param sidecar: bool
+        Read the grid through an `.npy` sidecar file
+    """
+
+    key = heatmap_key(input_image)
+    if key not in _heatmaps:
+        matrix = read_sidecar(input_image) if sidecar else read_heatmap(input_image)
+        matrix.flags.writeable = False
+        _heatmaps[key] = matrix
+    return _heatmaps[key]
+
+
+def load_sampler(input_image: str, sidecar: bool = False) -> "HeatmapSampler":
+    """Cached HeatmapSampler of an image, see load_heatmap"""
+    key = heatmap_key(input_image)
+    if key not in _samplers:
+        _samplers[key] = HeatmapSampler(load_heatmap(input_image, sidecar))
+    return _samplers[key]
+
+
+class HeatmapSampler:
+    """Walker alias table over the cells of a heatmap
+
+    Built once per heatmap and shared by every car that uses it, after that a
+    draw is O(1) instead of validating the whole probability vector each time.
+
+    :param matrix: np.matrix
+        Probability grid as returned by load_heatmap
+    """
+
+    def __init__(self, matrix: np.matrix) -> None:
+        self.matrix: np.matrix = matrix
+        p = np.asarray(matrix, dtype=float).ravel()
+        self.digest: str = hashlib.sha1(p.tobytes()).hexdigest()[:12]
+        self.size: int = p.size
+        scaled = (p * self.size / p.sum()).tolist()
+        prob = [1.0] * self.size
+        alias = list(range(self.size))
+        small = [i for i, q in enumerate(scaled) if q < 1]
+        large = [i for i, q in enumerate(scaled) if q >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s], alias[s] = scaled[s], l
+            scaled[l] += scaled[s] - 1
+            (small if scaled[l] < 1 else large).append(l)
+        self.prob: np.ndarray = np.array(prob)
+        self.alias: np.ndarray = np.array(alias)
+
+    def draw(self, generator, size: int = None):
+        """Draw flat cell indices, a single int if no size is given
+
+        Any generator with a random() method works for a single draw, so cars
+        can use their random.Random, batches need a np.random.Generator.
+        """
+        if size is None:
+            u = generator.random() * self.size
+            i = min(int(u), self.size - 1)
+            return i if u - i < self.prob[i] else int(self.alias[i])
+        u = generator.random(size) * self.size
+        i = np.minimum(u.astype(np.int64), self.size - 1)
+        return np.where(u - i < self.prob[i], i, self.alias[i])
+
+
+def heatmap_target(choice, size=(X_MAX, Y_MAX)):
+    """Map a flat heatmap cell index (or an array of them) to a point on the map"""
+    return choice // 100 * size[0] / 100, size[1] - choice % 100 * size[1] / 100
+
+
+class VisitMap:
+    """Number of visits to every unit cell of the map, a 2D histogram built from batches of positions
+
+    A position (x, y) counts for cell counts[int(y), int(x)], wrapped around the
+    map if `mod` (torus models). Positions can be added per car, per round or
+    per run, and maps of different runs or processes merged, so a sweep can sum
+    the visits of all its runs without keeping any trace.
+
+    :param size: (int, int)
+        Size of the map, e.g. config.size
+    :param mod: bool
+        Wrap positions around the map
+    """
+
+    def __init__(self, size: (int, int) = (X_MAX, Y_MAX), mod: bool = False) -> None:
+        self.size: (int, int) = tuple(size)
+        self.mod: bool = mod
+        self.counts: np.ndarray = np.zeros((self.size[1] + 1, self.size[0] + 1), dtype=np.int64)
+
+    def add(self, positions) -> None:
+        """Count an array-like of (x, y) positions"""
+        cells = np.asarray(positions, dtype=float).reshape(-1, 2).astype(np.int64)
+        if self.mod:
+            cells %= self.size
+        shape = self.counts.shape
+        inside = ((cells >= 0) & (cells < (shape[1], shape[0]))).all(axis=1)
+        flat = cells[inside, 1] * shape[1] + cells[inside, 0]
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(shape)
+
+    def merge(self, other: "VisitMap") -> None:
+        assert other.counts.shape == self.counts.shape, "visit maps of different map sizes"
+        self.counts += other.counts
+
+    def save(self, path: str) -> None:
+        np.save(path, self.counts)
+
+    @staticmethod
+    def load(path: str, mod: bool = False) -> "VisitMap":
+        counts = np.load(path)
+        visits = VisitMap((counts.shape[1] - 1, counts.shape[0] - 1), mod)
+        visits.counts += counts
+        return visits
+
+
 def rwp_1_diagonal():
     pair = [(X_MAX, Y_MAX), (0, 0)]
     trace = []
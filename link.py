@@ -0,0 +1,80 @@
+import numpy as np
+
+from help import Config
+
+
+class Link:
+    """Radio link between cars, decides which uninformed cars receive the message in a round
+
+    A car within config.radio_range of k informed cars gets the message
+    through with chance 1 - (1 - config.delivery) ** k, every contact is a try
+    of its own. It has received the message once it got it through in
+    config.transmit_rounds rounds in a row, a round without it starts the
+    count over. The defaults (range 1, delivery 1, one round) inform every car
+    in range at once, as the simulations always did.
+
+    Both engines work on arrays of all uninformed cars at once, so lossy or
+    slow links cost a few array operations per round and no loop over pairs.
+    Other models subclass it and set the link_model of a simulation class.
+
+    :param config: Config
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.radio_range: float = config.radio_range
+        self.delivery: float = config.delivery
+        self.transmit_rounds: int = config.transmit_rounds
+
+    @property
+    def instant(self) -> bool:
+        """Every car in range is informed in the same round"""
+        return self.delivery == 1 and self.transmit_rounds == 1
+
+    def transmit(self, contacts: np.ndarray, streak: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """Rounds in a row every uninformed car got the message through, including this one
+
+        :param contacts: np.ndarray
+            Number of informed cars in range of every uninformed car
+        :param streak: np.ndarray
+            The same, up to the round before
+        :param rng: np.random.Generator
+            Only drawn from if delivery < 1, once per car in range
+        """
+
+        through = contacts > 0
+        if self.delivery < 1:
+            tries = np.flatnonzero(through)
+            through[tries] = rng.random(tries.size) < 1 - (1 - self.delivery) ** contacts[tries]
+        return np.where(through, streak + 1, 0)
+
+    def received(self, streak: np.ndarray) -> np.ndarray:
+        return streak >= self.transmit_rounds
+
+    def spread(self, messages: np.ndarray, streak: np.ndarray, query_idx: np.ndarray, point_idx: np.ndarray,
+               rng: np.random.Generator, rd: int) -> None:
+        """Pass every message on over the contacts of round `rd`, updating `messages` and `streak` in place
+
+        The contacts are found once for all messages, query_idx and point_idx
+        list every ordered pair of cars within range (a car may be paired with
+        itself, it never informs itself).
+
+        :param messages: np.ndarray
+            (N, M) round every car got every message, -1 if it has not yet
+        :param streak: np.ndarray
+            (N, M) transmit streaks, see transmit
+        """
+
+        informed = messages >= 0
+        size, count = messages.shape
+        # informed cars in range of every car, for every message, in one bincount
+        keys = (query_idx[:, None] * count + np.arange(count)).ravel()
+        contacts = np.bincount(keys, weights=informed[point_idx].ravel(), minlength=messages.size)
+        rows, cols = np.nonzero(~informed)
+        contacts = contacts.reshape(size, count)[rows, cols].astype(np.int64)
+        if self.instant:
+            hit = contacts > 0
+        else:
+            tries = self.transmit(contacts, streak[rows, cols], rng)
+            streak[rows, cols] = tries
+            hit = self.received(tries)
+        messages[rows[hit], cols[hit]] = rd
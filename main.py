@@ -1,12 +1,14 @@
-from time import time
-
 from base import *
-from view import GUISnapshot2
+from vec import EventSimulation, VecMGSimulation, VecSynSimulation, VecTorSynSimulation
+from sinks import BinaryTraceSink
 
 
 class RWP2DCar(SynCar):
+    __slots__ = ()
+
     def set_target(self):
         if self.target_idx == len(self.targets):
+            x_max, y_max = self.config.size
             px, py = self.get_prev_target()
 
             # if the source has reached the last target,
@@ -15,15 +17,17 @@ class RWP2DCar(SynCar):
                 self.targets.append((px, py))
                 return
 
-            tx = self.rand.uniform(0, X_MAX)
-            ty = self.rand.uniform(0, Y_MAX)
+            tx = self.rand.uniform(0, x_max)
+            ty = self.rand.uniform(0, y_max)
             while tx == px and ty == py:
-                tx = self.rand.uniform(0, X_MAX)
-                ty = self.rand.uniform(0, Y_MAX)
+                tx = self.rand.uniform(0, x_max)
+                ty = self.rand.uniform(0, y_max)
             self.targets.append((tx, ty))
 
 
 class RWP3DCar(SynCar):
+    __slots__ = ()
+
     def set_target(self):
         if self.target_idx == len(self.targets):
             px, py = self.get_prev_target()
@@ -35,10 +39,10 @@ class RWP3DCar(SynCar):
                 return
 
             cx, cy = self.get_pos()
-            x_max = cx + 0.5 * X_MAX
-            x_min = cx - 0.5 * X_MAX
-            y_max = cy + 0.5 * Y_MAX
-            y_min = cy - 0.5 * Y_MAX
+            x_max = cx + 0.5 * self.config.x_max
+            x_min = cx - 0.5 * self.config.x_max
+            y_max = cy + 0.5 * self.config.y_max
+            y_min = cy - 0.5 * self.config.y_max
             tx = self.rand.uniform(x_min, x_max)
             ty = self.rand.uniform(y_min, y_max)
             while tx == px and ty == py:
@@ -48,8 +52,11 @@ class RWP3DCar(SynCar):
 
 
 class RDCar(SynCar):
+    __slots__ = ()
+
     def set_target(self):
         if self.target_idx == len(self.targets):
+            x_max, y_max = self.config.size
             px, py = self.get_prev_target()
 
             # if the source has reached the last target,
@@ -58,39 +65,42 @@ class RDCar(SynCar):
                 self.targets.append((px, py))
                 return
 
-            max_target = 2 * X_MAX + 2 * Y_MAX
+            max_target = 2 * x_max + 2 * y_max
             while True:
                 raw_target = self.rand.uniform(0, max_target)
-                if 0 <= raw_target < X_MAX:
+                if 0 <= raw_target < x_max:
                     target = (raw_target, 0)
-                elif X_MAX <= raw_target < X_MAX + Y_MAX:
-                    raw_target -= X_MAX
-                    target = (X_MAX, raw_target)
-                elif X_MAX + Y_MAX <= raw_target < 2 * X_MAX + Y_MAX:
-                    raw_target -= (X_MAX + Y_MAX)
-                    target = ((X_MAX - raw_target), Y_MAX)
+                elif x_max <= raw_target < x_max + y_max:
+                    raw_target -= x_max
+                    target = (x_max, raw_target)
+                elif x_max + y_max <= raw_target < 2 * x_max + y_max:
+                    raw_target -= (x_max + y_max)
+                    target = ((x_max - raw_target), y_max)
                 else:
-                    raw_target -= (2 * X_MAX + Y_MAX)
-                    target = (0, (Y_MAX - raw_target))
+                    raw_target -= (2 * x_max + y_max)
+                    target = (0, (y_max - raw_target))
 
                 if px == 0 and target[0] == 0:
                     continue
-                if px == X_MAX and target[0] == X_MAX:
+                if px == x_max and target[0] == x_max:
                     continue
                 if py == 0 and target[1] == 0:
                     continue
-                if py == Y_MAX and target[1] == Y_MAX:
+                if py == y_max and target[1] == y_max:
                     continue
                 break
             self.targets.append(target)
 
 
 class MG2DCar(SynMGCar):
-    def __init__(self, index, seed, source_pos, targets=None):
-        super().__init__(index, seed, source_pos, targets, 1)
+    __slots__ = ()
+
+    def __init__(self, index, seed, source_pos, targets=None, config=None, rand=None):
+        super().__init__(index, seed, source_pos, targets, 1, config, rand)
 
     def set_target(self):
         if self.target_idx == len(self.targets):
+            x_max, y_max = self.config.size
             px, py = self.get_prev_target()
 
             # if the source has reached the last target,
@@ -103,11 +113,11 @@ class MG2DCar(SynMGCar):
             dirs = [(cx - 1, cy), (cx + 1, cy), (cx, cy - 1), (cx, cy + 1)]
             if cx == 0:
                 dirs.remove((cx - 1, cy))
-            elif cx == X_MAX:
+            elif cx == x_max:
                 dirs.remove((cx + 1, cy))
             if cy == 0:
                 dirs.remove((cx, cy - 1))
-            elif cy == Y_MAX:
+            elif cy == y_max:
                 dirs.remove((cx, cy + 1))
             assert len(dirs) in [2, 3, 4]
             if len(dirs) == 2:
@@ -117,12 +127,13 @@ class MG2DCar(SynMGCar):
             else:
                 weights = [0.25 for _ in range(4)]
 
-            if len(self.courses) == 1:
+            last = self.get_prev_pos()
+            if last is None:
                 direction = self.rand.choices(dirs, weights)
                 assert len(direction) == 1
                 direction = direction[0]
             else:
-                last_x, last_y = self.courses[-2]
+                last_x, last_y = last
                 assert (last_x, last_y) in dirs
                 last_idx = dirs.index((last_x, last_y))
 
@@ -150,13 +161,16 @@ class MG2DCar(SynMGCar):
 
 
 class MG3DCar(SynMGCar):
-    def __init__(self, index, seed, source_pos, targets=None):
-        super().__init__(index, seed, source_pos, targets, 2)
+    __slots__ = ()
+
+    def __init__(self, index, seed, source_pos, targets=None, config=None, rand=None):
+        super().__init__(index, seed, source_pos, targets, 2, config, rand)
 
     def set_target(self):
         if self.target_idx == len(self.targets):
 
             px, py = self.get_prev_target()
+            x_max, y_max = self.config.size
 
             # if the source has reached the last target,
             # append the previous target so that it won't generate a new one
@@ -166,28 +180,29 @@ class MG3DCar(SynMGCar):
 
             cx, cy = self.get_pos()
             dirs = [(cx - 1, cy), (cx + 1, cy), (cx, cy - 1), (cx, cy + 1)]
-            dirs = [(x % X_MAX, y % Y_MAX) for (x, y) in dirs]
+            dirs = [(x % x_max, y % y_max) for (x, y) in dirs]
             weights = [0.25 for _ in range(4)]
 
-            if len(self.courses) == 1:
+            last = self.get_prev_pos()
+            if last is None:
                 direction = self.rand.choices(dirs, weights)
                 assert len(direction) == 1
                 direction = direction[0]
             else:
-                last_x, last_y = self.courses[-2]
-                last_x, last_y = last_x % X_MAX, last_y % Y_MAX
+                last_x, last_y = last
+                last_x, last_y = last_x % x_max, last_y % y_max
                 assert (last_x, last_y) in dirs
                 last_idx = dirs.index((last_x, last_y))
 
-                if (last_x, last_y) == ((cx - 1) % X_MAX, cy % Y_MAX):
+                if (last_x, last_y) == ((cx - 1) % x_max, cy % y_max):
                     opposite = (cx + 1, cy)
-                elif (last_x, last_y) == ((cx + 1) % X_MAX, cy % Y_MAX):
+                elif (last_x, last_y) == ((cx + 1) % x_max, cy % y_max):
                     opposite = (cx - 1, cy)
-                elif (last_x, last_y) == (cx % X_MAX, (cy - 1) % Y_MAX):
+                elif (last_x, last_y) == (cx % x_max, (cy - 1) % y_max):
                     opposite = (cx, cy + 1)
                 else:
                     opposite = (cx, cy - 1)
-                opposite = opposite[0] % X_MAX, opposite[1] % Y_MAX
+                opposite = opposite[0] % x_max, opposite[1] % y_max
 
                 # in torus map, the opposite is always an option
                 plus_idx = dirs.index(opposite)
@@ -202,11 +217,22 @@ class MG3DCar(SynMGCar):
 
 
 class PG2DCar(SynCar):
-    def __init__(self, index, seed, source_pos, matrix=None, targets=None) -> None:
-        super().__init__(index, seed, source_pos, targets)
+    __slots__ = ("sampler", "matrix")
+
+    def __init__(self, index, seed, source_pos, matrix=None, targets=None, sampler=None, config=None,
+                 rand=None) -> None:
+        super().__init__(index, seed, source_pos, targets, config, rand)
+
+        if sampler is None and matrix is not None:
+            sampler = HeatmapSampler(matrix)
+        self.sampler: HeatmapSampler = sampler
+        self.matrix: np.matrix = matrix if sampler is None else sampler.matrix
 
-        self.matrix: np.matrix = matrix
-        self.generator: np.random.Generator = np.random.default_rng()
+    def spawn(self, index, seed) -> "PG2DCar":
+        return PG2DCar(index, seed, (-1, -1), sampler=self.sampler, config=self.config)
+
+    def stationary_key(self) -> str:
+        return f"{super().stationary_key()}-{self.sampler.digest}"
 
     def set_target(self) -> None:
         if self.target_idx == len(self.targets):
@@ -217,76 +243,161 @@ class PG2DCar(SynCar):
                 return
 
             # Choose a random point based on the probabilities on the heatmap
-            choice: int = self.generator.choice(self.matrix.size, p=np.array(self.matrix).flatten())
-            target: (int, int) = (choice // 100 / 2, (50 - choice % 100 / 2))
+            choice: int = self.sampler.draw(self.rand)
+            target: (int, int) = heatmap_target(choice, self.config.size)
             self.targets.append(target)
 
 
 class RWP2DSimulation(SynSimulation):
-    def __init__(self, seed, source_pos, source_source):
-        super().__init__()
-        self.cars.append(RWP2DCar(0, seed, source_pos, source_source))
-        self.cars.extend([RWP2DCar(car_i, seed, source_pos) for car_i in range(1, NUM_OF_CARS)])
+    def __init__(self, seed, source_pos, source_source, config=None):
+        super().__init__(config, seed)
+        self.cars.append(RWP2DCar(0, seed, source_pos, source_source, self.config, self.rand))
+        self.cars.extend([RWP2DCar(car_i, seed, source_pos, config=self.config, rand=self.rand)
+                          for car_i in range(1, self.config.num_of_cars)])
 
 
 class RWP3DSimulation(TorSynSimulation):
-    def __init__(self, seed, source_pos, source_source):
-        super().__init__()
-        self.cars.append(RWP3DCar(0, seed, source_pos, source_source))
-        self.cars.extend([RWP3DCar(car_i, seed, source_pos) for car_i in range(1, NUM_OF_CARS)])
+    def __init__(self, seed, source_pos, source_source, config=None):
+        super().__init__(config, seed)
+        self.cars.append(RWP3DCar(0, seed, source_pos, source_source, self.config, self.rand))
+        self.cars.extend([RWP3DCar(car_i, seed, source_pos, config=self.config, rand=self.rand)
+                          for car_i in range(1, self.config.num_of_cars)])
 
 
 class RDSimulation(SynSimulation):
-    def __init__(self, seed, source_pos, source_source):
-        super().__init__()
-        self.cars.append(RDCar(0, seed, source_pos, source_source))
-        self.cars.extend([RDCar(car_i, seed, source_pos) for car_i in range(1, NUM_OF_CARS)])
+    def __init__(self, seed, source_pos, source_source, config=None):
+        super().__init__(config, seed)
+        self.cars.append(RDCar(0, seed, source_pos, source_source, self.config, self.rand))
+        self.cars.extend([RDCar(car_i, seed, source_pos, config=self.config, rand=self.rand)
+                          for car_i in range(1, self.config.num_of_cars)])
 
 
 class MG2DSimulation(SynSimulation):
-    def __init__(self, seed, source_pos, source_source):
-        super().__init__()
-        self.cars.append(MG2DCar(0, seed, source_pos, source_source))
-        self.cars.extend([MG2DCar(car_i, seed, source_pos) for car_i in range(1, NUM_OF_CARS)])
+    def __init__(self, seed, source_pos, source_source, config=None):
+        super().__init__(config, seed)
+        self.cars.append(MG2DCar(0, seed, source_pos, source_source, self.config, self.rand))
+        self.cars.extend([MG2DCar(car_i, seed, source_pos, config=self.config, rand=self.rand)
+                          for car_i in range(1, self.config.num_of_cars)])
 
 
 class MG3DSimulation(TorSynSimulation):
-    def __init__(self, seed, source_pos, source_source):
-        super().__init__()
-        self.cars.append(MG3DCar(0, seed, source_pos, source_source))
-        self.cars.extend([MG3DCar(car_i, seed, source_pos) for car_i in range(1, NUM_OF_CARS)])
+    def __init__(self, seed, source_pos, source_source, config=None):
+        super().__init__(config, seed)
+        self.cars.append(MG3DCar(0, seed, source_pos, source_source, self.config, self.rand))
+        self.cars.extend([MG3DCar(car_i, seed, source_pos, config=self.config, rand=self.rand)
+                          for car_i in range(1, self.config.num_of_cars)])
 
 
 class PG2DSimulation(SynSimulation):
-    def __init__(self, seed, source_pos: (int, int), source_source: (int, int), input_images: [str]):
-        super().__init__()
+    needs_heat_maps = True
+
+    def __init__(self, seed, source_pos: (int, int), source_source: (int, int), input_images: [str], config=None):
+        super().__init__(config, seed)
         # Add source vehicle
-        self.cars.append(PG2DCar(0, seed, source_pos, targets=source_source))
+        self.cars.append(PG2DCar(0, seed, source_pos, targets=source_source, config=self.config, rand=self.rand))
         # Add the recipient vehicles
-        matrices = [load_heatmap(image) for image in input_images]
-        chunk_amount = len(matrices)
-        chunk_size = (NUM_OF_CARS - 1) // chunk_amount
-        chunks = [chunk_size for _ in range(chunk_amount)]
-        for j in range((NUM_OF_CARS - 1) % chunk_amount):
-            chunks[j] += 1
+        samplers = [load_sampler(image) for image in input_images]
+        chunks = split_evenly(self.config.num_of_cars - 1, len(samplers))
         car_i = 1
         for j, chunk in enumerate(chunks):
             for _ in range(chunk):
-                new_car = PG2DCar(car_i, seed, source_pos, matrix=matrices[j])
+                new_car = PG2DCar(car_i, seed, source_pos, sampler=samplers[j], config=self.config, rand=self.rand)
                 self.cars.append(new_car)
                 car_i += 1
 
 
+class VecRWP2DSimulation(VecSynSimulation):
+    def draw_targets(self, idx):
+        return self.rng.uniform(0, 1, (idx.size, 2)) * self.config.size
+
+
+class VecRWP3DSimulation(VecTorSynSimulation):
+    def draw_targets(self, idx):
+        return self.pos[idx] + self.rng.uniform(-0.5, 0.5, (idx.size, 2)) * self.config.size
+
+
+class VecRDSimulation(VecSynSimulation):
+    def draw_targets(self, idx):
+        x_max, y_max = self.config.size
+        px, py = self.prev[idx].T
+        targets = np.empty((idx.size, 2))
+        todo = np.arange(idx.size)
+        while todo.size:
+            raw = self.rng.uniform(0, 2 * x_max + 2 * y_max, todo.size)
+            bottom = raw < x_max
+            right = ~bottom & (raw < x_max + y_max)
+            top = ~bottom & ~right & (raw < 2 * x_max + y_max)
+            tx = np.select([bottom, right, top], [raw, x_max, x_max - (raw - (x_max + y_max))], 0)
+            ty = np.select([bottom, right, top], [0, raw - x_max, y_max], y_max - (raw - (2 * x_max + y_max)))
+
+            # never pick a target on the side the car is already on
+            same_side = (((px[todo] == 0) & (tx == 0)) | ((px[todo] == x_max) & (tx == x_max))
+                         | ((py[todo] == 0) & (ty == 0)) | ((py[todo] == y_max) & (ty == y_max)))
+            targets[todo, 0] = tx
+            targets[todo, 1] = ty
+            todo = todo[same_side]
+        return targets
+
+
+class EventRWP2DSimulation(EventSimulation, VecRWP2DSimulation):
+    torus = False
+
+
+class EventRWP3DSimulation(EventSimulation, VecRWP3DSimulation):
+    torus = True
+
+
+class EventRDSimulation(EventSimulation, VecRDSimulation):
+    torus = False
+
+
+class VecMG2DSimulation(VecMGSimulation, VecSynSimulation):
+    torus = False
+
+
+class VecMG3DSimulation(VecMGSimulation, VecTorSynSimulation):
+    torus = True
+
+
+class VecPG2DSimulation(VecSynSimulation):
+    needs_heat_maps = True
+
+    def __init__(self, seed, source_pos: (int, int), source_source: (int, int), input_images: [str], replicas=1,
+                 config=None):
+        super().__init__(seed, source_pos, source_source, replicas, config)
+        self.samplers = [load_sampler(image) for image in input_images]
+        # same split of the recipient vehicles over the heatmaps as PG2DSimulation
+        chunks = split_evenly(self.n - 1, len(self.samplers))
+        self.heatmap_of = np.repeat(np.arange(len(chunks)), chunks)
+
+    def draw_targets(self, idx):
+        targets = np.empty((idx.size, 2))
+        groups = self.heatmap_of[idx % self.n - 1]
+        for j, sampler in enumerate(self.samplers):
+            members = np.flatnonzero(groups == j)
+            if members.size:
+                # Choose random points based on the probabilities on the heatmap
+                choice = sampler.draw(self.rng, members.size)
+                targets[members, 0], targets[members, 1] = heatmap_target(choice, self.config.size)
+        return targets
+
+
 if __name__ == '__main__':
-    RAND_SEED = "%.30f" % time()
-    # 1584493223.638249874114990234375000000000]
-    # print(RAND_SEED)
+    # plotting is only loaded here, pool workers that import the simulations never need matplotlib
+    from view import render_frames
+
+    # fresh OS entropy, the printed seed replays the run
+    RAND_SEED = format_seed(seed_sequence(None))
+    print(RAND_SEED)
     SOURCE_POS = (0, 0)
+    TRACE = "./pngs/trace.bin"
     sim = PG2DSimulation(RAND_SEED, SOURCE_POS, None, ["./heatmaps/corner.jpg"])
-    step_count = sim.simulate()
+    # the positions of every round go to disk as the run goes, the frames are drawn from there
+    # the sink is closed even if the run fails, closing writes the index TraceFile needs to read it back
+    with BinaryTraceSink(TRACE) as sink:
+        sim.sink = sink
+        sim.streaming = True
+        step_count = sim.simulate()
 
     print("Finished simulation, drawing .png files...")
-    for i in range(step_count):
-        gui = GUISnapshot2(sim, i)
-        gui.draw()
-        gui.save(f"./pngs/{i}")
+    render_frames(TRACE, sim.config.size, "./pngs")
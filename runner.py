@@ -0,0 +1,457 @@
+import csv
+import hashlib
+import itertools
+import math
+import multiprocessing as mp
+import os
+import queue
+from contextlib import nullcontext
+from time import time
+
+import numpy as np
+
+from grid import TorSpatialGrid
+from help import NUM_OF_CARS, NUM_OF_MOVES, X_MAX, Config, VisitMap, child_seed, format_seed, load_sampler, \
+    seed_sequence
+from stationary import preload_stationary
+from stats import PhaseStats
+from vec import VecSimulation
+
+
+def run_batch(task: (type, tuple, dict, int, np.random.SeedSequence, bool, bool)) \
+        -> ([(str, int)], PhaseStats, VisitMap):
+    """Run one batch of simulations and return the seed and round count of every run
+
+    Vectorized simulations run the whole batch as replicas of one array
+    simulation, object-based ones run it one after another in streaming mode.
+    The seeds are returned as run_seeds strings, any run can be replayed from
+    its seed with replay(). With `profile` set the PhaseStats of the batch are returned as well, and
+    with `visits` the VisitMap of all its runs, None otherwise.
+    """
+
+    sim_class, args, kwargs, amount, batch_seed, profile, visits = task
+    stats = PhaseStats() if profile else None
+    if visits:
+        visits = VisitMap(kwargs.get("config", Config()).size, mod=issubclass(sim_class.grid, TorSpatialGrid))
+    else:
+        visits = None
+    seeds = run_seeds(sim_class, amount, batch_seed)
+    if issubclass(sim_class, VecSimulation):
+        simulation = sim_class(batch_seed, *args, replicas=amount, **kwargs)
+        # only the rounds count is needed, a batch of one would keep its whole history otherwise
+        simulation.record = False
+        simulation.stats = stats
+        simulation.visits = visits
+        simulation.simulate()
+        return list(zip(seeds, simulation.rounds.tolist())), stats, visits
+
+    result = []
+    for seed in seeds:
+        simulation = sim_class(seed, *args, **kwargs)
+        # only the rounds count is needed, so keep the memory use of a run constant
+        simulation.streaming = True
+        simulation.stats = stats
+        simulation.visits = visits
+        simulation.simulate()
+        result.append((seed, simulation.rounds))
+    return result, stats, visits
+
+
+def run_seeds(sim_class: type, amount: int, batch_seed: np.random.SeedSequence) -> [str]:
+    """Seed of every run of a batch, as logged
+
+    An object-based run has a stream of its own below the batch, its seed is
+    that stream's format_seed. The replicas of a vectorized batch share the
+    batch's stream, their seed is the batch seed, the replica index and the
+    number of replicas, e.g. "1234/5#3/16".
+    """
+
+    if issubclass(sim_class, VecSimulation):
+        return [f"{format_seed(batch_seed)}#{count}/{amount}" for count in range(amount)]
+    return [format_seed(child_seed(batch_seed, count)) for count in range(amount)]
+
+
+def replay(sim_class: type, seed: str, *args, **kwargs):
+    """Run a logged run of `sim_class` again, exactly as in its sweep
+
+    `seed` is the seed the log has for the run, the other arguments are the
+    ones the Runner was given. Returns the simulation after simulate() and the
+    replica the run is, 0 for an object-based one.
+    """
+
+    batch, _, replica = seed.partition("#")
+    if replica:
+        replica, replicas = map(int, replica.split("/"))
+        simulation = sim_class(batch, *args, replicas=replicas, **kwargs)
+    else:
+        replica = 0
+        simulation = sim_class(seed, *args, **kwargs)
+    simulation.simulate()
+    return simulation, replica
+
+
+def scenario_digest(sim_class: type, args: tuple, kwargs: dict) -> str:
+    """Short hash of everything but the seed that a run depends on
+
+    Covers the constructor arguments (source position and targets, config)
+    and the heatmaps by their content, not their path, so a log only resumes
+    runs of the very same scenario.
+    """
+
+    def canonical(value):
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        if isinstance(value, (list, tuple)):
+            return [canonical(item) for item in value]
+        if isinstance(value, dict):
+            return {key: canonical(value[key]) for key in sorted(value)}
+        return value if value is None or isinstance(value, (bool, int, float, str)) else str(value)
+
+    args, kwargs = list(args), dict(kwargs)
+    if sim_class.needs_heat_maps:
+        # input_images follows source_pos and source_source
+        if "input_images" in kwargs:
+            kwargs["input_images"] = [load_sampler(image).digest for image in kwargs["input_images"]]
+        else:
+            args[2] = [load_sampler(image).digest for image in args[2]]
+    scenario = repr([sim_class.__name__, canonical(args), canonical(kwargs)])
+    return hashlib.sha1(scenario.encode()).hexdigest()[:12]
+
+
+class ResultLog:
+    """Append-only CSV of finished runs, one (seed, model, rounds) row per run
+
+    Rows are written a whole batch at a time and flushed right away, so an
+    interrupted sweep loses at most the batches that were still running.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a", newline="")
+        self.writer = csv.writer(self.file)
+        if new:
+            self.writer.writerow(["seed", "model", "rounds"])
+
+    @staticmethod
+    def read(path: str, model: str) -> {str: int}:
+        if not os.path.exists(path):
+            return {}
+        with open(path, newline="") as file:
+            return {row["seed"]: int(row["rounds"]) for row in csv.DictReader(file) if row["model"] == model}
+
+    def write(self, model: str, records: [(str, int)]) -> None:
+        self.writer.writerows((seed, model, rounds) for seed, rounds in records)
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class Runner:
+    """Runs many independent simulations of one of the *Simulation classes over a process pool
+
+    The runs are handed out in small batches, an idle worker just takes the next
+    batch, so long runs don't leave the other cores waiting at the end. Round
+    counts are streamed back as soon as their batch is done.
+
+    Every batch and run gets its own SeedSequence stream below the sweep
+    `seed`, so runs are reproducible and workers never share a stream. With a
+    `log` a sweep that is restarted with the same seed and batch_size skips the
+    batches that were already logged and only runs the rest.
+
+    :param sim_class: type
+        Simulation class to run, e.g. PG2DSimulation or VecPG2DSimulation
+    :param args:
+        Constructor arguments after the seed, e.g. source_pos and source_source
+    :param batch_size: int
+        Number of runs handed to a worker at once
+    :param processes: int
+        Number of worker processes, all cores if None
+    :param progress: bool
+        Show one progress bar over all runs
+    :param seed: int or str
+        Seed of the whole sweep, fresh OS entropy if None
+    :param log: str
+        Path of the CSV file finished runs are appended to
+    :param config: Config
+        Settings passed to every simulation, the help.py defaults if None
+    :param name: str
+        Name of the runs in the log, the class name (and config, if given) by default. The
+        log keys them by this name and a scenario_digest of the arguments
+    :param pool: multiprocessing.pool.Pool or cluster.Coordinator
+        Existing pool to run on, it is left open afterwards. With a Coordinator
+        `processes` is the number of worker processes on all hosts. A pool of its own
+        is made for every call if None
+    :param profile: bool
+        Collect the PhaseStats of every run, summed over all workers in `stats`
+    :param visits: bool
+        Count where the peers are in every round of every run, summed over all
+        workers in the VisitMap `visits`. Not for the event engine
+    """
+
+    def __init__(self, sim_class: type, *args, batch_size: int = 16, processes: int = None,
+                 progress: bool = True, seed=None, log: str = None, config: Config = None, name: str = None,
+                 pool=None, profile: bool = False, visits: bool = False, **kwargs) -> None:
+        assert 0 < batch_size
+        self.sim_class: type = sim_class
+        self.args: tuple = args
+        self.config: Config = Config() if config is None else config
+        self.kwargs: dict = dict(kwargs, config=self.config)
+        self.batch_size: int = batch_size
+        self.processes: int = processes or mp.cpu_count()
+        self.progress: bool = progress
+        self.seed: np.random.SeedSequence = seed_sequence(seed)
+        self.log: str = log
+        if name is None:
+            name = sim_class.__name__ if config is None else f"{sim_class.__name__} {config}"
+        self.name: str = name
+        # a changed source or heatmap must not resume the runs of the old scenario
+        self.model: str = f"{name} #{scenario_digest(sim_class, args, self.kwargs)}"
+        self.pool = pool
+        self.profile: bool = profile
+        # batches read back from the log were not run, so they are not in these
+        self.stats: PhaseStats = PhaseStats() if profile else None
+        self.count_visits: bool = visits
+        self.visits: VisitMap = None
+        if visits:
+            self.visits = VisitMap(self.config.size, mod=issubclass(sim_class.grid, TorSpatialGrid))
+
+    def tasks(self, total: int):
+        """Yield the batches of a sweep of `total` runs, endless if total is None"""
+        batch = 0
+        while total is None or batch * self.batch_size < total:
+            amount = self.batch_size if total is None else min(self.batch_size, total - batch * self.batch_size)
+            yield self.sim_class, self.args, self.kwargs, amount, child_seed(self.seed, batch), self.profile, \
+                self.count_visits
+            batch += 1
+
+    def batches(self, tasks):
+        """Yield the (seed, rounds) records of every batch, in the order the batches were handed out
+
+        Only a few batches per worker are handed out ahead, so `tasks` may be
+        endless and the caller can stop at any point (batches still running on a
+        shared pool then finish in the background). Batches that are already in
+        the log are read back instead of run.
+
+        A batch that finishes early waits for the batches handed out before it,
+        so stopping after any batch keeps a prefix of the sweep. Stopping on the
+        batches that happen to finish first would favour the short runs. It is
+        logged right away though, a resumed sweep does not run it again.
+        """
+
+        model = self.model
+        done = ResultLog.read(self.log, model) if self.log is not None else {}
+        log = ResultLog(self.log) if self.log is not None else None
+        if self.config.stationary_start and not issubclass(self.sim_class, VecSimulation):
+            # otherwise every worker would sample the same states at the same time on first use
+            preload_stationary(self.sim_class(self.seed, *self.args, **self.kwargs))
+        finished = queue.SimpleQueue()
+        # batches that finished ahead of their turn, by the index they were handed out at
+        ahead = {}
+        running = 0
+        handed_out = 0
+        turn = 0
+        pool = mp.Pool(self.processes) if self.pool is None else self.pool
+        try:
+            while True:
+                handed_out_before = handed_out
+                for task in itertools.islice(tasks, max(2 * self.processes - running, 0)):
+                    seeds = run_seeds(self.sim_class, task[3], task[4])
+                    if all(seed in done for seed in seeds):
+                        ahead[handed_out] = ([(seed, done[seed]) for seed in seeds], None, None)
+                    else:
+                        pool.apply_async(run_batch, (task,),
+                                         callback=lambda result, index=handed_out: finished.put((index, result)),
+                                         error_callback=lambda error, index=handed_out: finished.put((index, error)))
+                        running += 1
+                    handed_out += 1
+                while turn in ahead:
+                    records, stats, visits = ahead.pop(turn)
+                    turn += 1
+                    if stats is not None:
+                        self.stats.merge(stats)
+                    if visits is not None:
+                        self.visits.merge(visits)
+                    yield records
+                if not running:
+                    if handed_out == handed_out_before:
+                        return
+                    continue
+                index, result = finished.get()
+                running -= 1
+                if isinstance(result, BaseException):
+                    raise result
+                if log is not None:
+                    log.write(model, result[0])
+                ahead[index] = result
+        finally:
+            if log is not None:
+                log.close()
+            if self.pool is None:
+                pool.terminate()
+
+    def imap(self, total: int):
+        """Yield the round count of every run, in the order of their batches"""
+        from tqdm import tqdm  # only the parent shows progress, the workers that import run_batch don't need it
+        with tqdm(total=total, disable=not self.progress) as bar:
+            for records in self.batches(self.tasks(total)):
+                bar.update(len(records))
+                yield from (rounds for _, rounds in records)
+
+    def run(self, total: int) -> [int]:
+        return list(self.imap(total))
+
+    def until(self, width: float = None, max_runs: int = None, max_seconds: float = None,
+              min_runs: int = 100, z: float = 1.96) -> "Estimate":
+        """Keep running until the confidence interval of the mean rounds is narrower than `width`
+
+        Also stops after `max_runs` runs or once `max_seconds` have passed, at
+        least one of the three limits must be given. The batches are counted in
+        the order they were handed out, see batches(), those that are still
+        running or waiting for their turn when it stops are left out. The
+        running estimate is shown on the progress bar.
+
+        :param width: float
+            Target width (in rounds) of the confidence interval
+        :param max_runs: int
+            Upper bound on the number of runs
+        :param max_seconds: float
+            Upper bound on the wall-clock time
+        :param min_runs: int
+            Never stop on the interval before this many runs are done
+        :param z: float
+            z-score of the interval, 1.96 for 95%
+        """
+
+        assert width is not None or max_runs is not None or max_seconds is not None
+        from tqdm import tqdm
+        estimate = Estimate(z, self.config.num_of_moves)
+        start = time()
+        with tqdm(total=max_runs, disable=not self.progress) as bar:
+            for records in self.batches(self.tasks(max_runs)):
+                estimate.extend(rounds for _, rounds in records)
+                bar.update(len(records))
+                bar.set_postfix_str(str(estimate))
+                if width is not None and estimate.runs >= min_runs and estimate.width < width:
+                    break
+                if max_seconds is not None and time() - start >= max_seconds:
+                    break
+        return estimate
+
+
+class Estimate:
+    """Running mean and confidence interval of the rounds needed to inform every car
+
+    Runs that hit `num_of_moves` timed out, they are counted but left out of the
+    statistics.
+    """
+
+    def __init__(self, z: float = 1.96, num_of_moves: int = NUM_OF_MOVES) -> None:
+        self.z: float = z
+        self.num_of_moves: int = num_of_moves
+        self.runs: int = 0
+        self.timeouts: int = 0
+        self.count: int = 0
+        self.total: float = 0
+        self.total_sq: float = 0
+        self.min: int = None
+        self.max: int = None
+
+    def add(self, rounds: int) -> None:
+        self.runs += 1
+        if rounds == self.num_of_moves:
+            self.timeouts += 1
+            return
+        self.count += 1
+        self.total += rounds
+        self.total_sq += rounds * rounds
+        self.min = rounds if self.min is None else min(self.min, rounds)
+        self.max = rounds if self.max is None else max(self.max, rounds)
+
+    def extend(self, results) -> None:
+        for rounds in results:
+            self.add(rounds)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else math.nan
+
+    @property
+    def width(self) -> float:
+        if self.count < 2:
+            return math.inf
+        variance = max(self.total_sq - self.total * self.total / self.count, 0) / (self.count - 1)
+        return 2 * self.z * math.sqrt(variance / self.count)
+
+    def __str__(self) -> str:
+        return f"{self.mean:.2f} ± {self.width / 2:.2f} rounds"
+
+
+class Sweep:
+    """Runs every point of a (model, NUM_OF_CARS, X_MAX, heatmap set) grid on one pool
+
+    The worker processes are made once and reused for every point, so their
+    imports and heatmap caches stay warm. All points use the same sweep seed,
+    differences between points are then not just noise from different seeds.
+    Each point is logged under its own name, see Runner.
+
+    :param models: [type]
+        Simulation classes to run
+    :param source_pos: (int, int)
+    :param source_source: [(int, int)]
+    :param num_of_cars: [int]
+    :param x_max: [int]
+        Map sizes, the map is always square
+    :param heat_maps: [[str]]
+        Heatmap sets, only used by the models that needs_heat_maps
+    :param pool: multiprocessing.pool.Pool or cluster.Coordinator
+        Pool to run every point on, it is left open afterwards. A pool of its
+        own is made for every call if None
+    :param settings:
+        Other Config settings shared by every point, e.g. num_of_moves
+    """
+
+    def __init__(self, models: [type], source_pos: (int, int), source_source: [(int, int)] = None,
+                 num_of_cars: [int] = (NUM_OF_CARS,), x_max: [int] = (X_MAX,), heat_maps: [[str]] = (),
+                 batch_size: int = 16, processes: int = None, progress: bool = True, seed=None, log: str = None,
+                 pool=None, **settings) -> None:
+        self.models: [type] = list(models)
+        self.source_pos: (int, int) = source_pos
+        self.source_source: [(int, int)] = source_source
+        self.num_of_cars: [int] = list(num_of_cars)
+        self.x_max: [int] = list(x_max)
+        self.heat_maps: [[str]] = [list(heat_map_set) for heat_map_set in heat_maps]
+        self.settings: dict = settings
+        self.batch_size: int = batch_size
+        self.processes: int = processes or mp.cpu_count()
+        self.progress: bool = progress
+        self.seed: np.random.SeedSequence = seed_sequence(seed)
+        self.log: str = log
+        self.pool = pool
+
+    def open_pool(self):
+        return mp.Pool(self.processes) if self.pool is None else nullcontext(self.pool)
+
+    def points(self, pool=None) -> [Runner]:
+        runners = []
+        for model, cars, size in itertools.product(self.models, self.num_of_cars, self.x_max):
+            config = Config(x_max=size, num_of_cars=cars, **self.settings)
+            extra = [(heat_map_set,) for heat_map_set in self.heat_maps] if model.needs_heat_maps else [()]
+            assert extra, f"{model.__name__} needs at least one heatmap set"
+            for args in extra:
+                name = " ".join([model.__name__, str(config), *(",".join(heat_map_set) for heat_map_set in args)])
+                runners.append(Runner(model, self.source_pos, self.source_source, *args, batch_size=self.batch_size,
+                                      processes=self.processes, progress=self.progress, seed=self.seed,
+                                      log=self.log, config=config, name=name, pool=pool))
+        return runners
+
+    def run(self, total: int) -> {str: [int]}:
+        """Run `total` simulations of every point, by point name"""
+        with self.open_pool() as pool:
+            return {runner.name: runner.run(total) for runner in self.points(pool)}
+
+    def until(self, *args, **kwargs) -> {str: Estimate}:
+        """Runner.until for every point, by point name"""
+        with self.open_pool() as pool:
+            return {runner.name: runner.until(*args, **kwargs) for runner in self.points(pool)}
@@ -1,54 +1,73 @@
 import multiprocessing as mp
+import os
 
-from tqdm import tqdm
+from cluster import Coordinator
 from main import *
-
-
-def run(_args: (int, int)) -> [int]:
-    amount, thread_index = _args
-    result = []
-    for count in tqdm(range(amount), position=thread_index):
-        simulation_seed = "%.30f" % time()
-
-        simulation = PG2DSimulation(simulation_seed, SOURCE_POS, SOURCE_TARGETS, HEAT_MAPS)
-        simulation.simulate()
-        rounds = len(simulation.num_of_broadcasters) - 1
-        result.append(rounds)
-    return result
+from runner import Runner
 
 
 if __name__ == '__main__':
-    # Simulation settings
-    # MAKE SURE VARIABLES IN HELP.PY ARE ALSO CORRECT
-    # EXCEED_MOVES must be set to True
+    # Simulation settings, the defaults come from the constants in help.py
+    # exceed_moves must be set to True
+    CONFIG = Config()
     SOURCE_POS = (25, 25)
     SOURCE_TARGETS = diamond()
     TOTAL_SIMULATION_COUNT = 10000
+    # Stop early once the 95% confidence interval of the average is narrower than this many rounds,
+    # None always runs TOTAL_SIMULATION_COUNT simulations
+    TARGET_WIDTH = None
+    # Optional wall-clock budget in seconds
+    MAX_SECONDS = None
+    # Run every batch as replicas of one simulation in the vectorized engine
+    BATCH_MODE = True
+    # Number of runs a worker takes at once
+    BATCH_SIZE = 64 if BATCH_MODE else 4
+    # Finished runs are appended here, rerunning with the same seed resumes the sweep
+    # pick a new seed to start a fresh sweep
+    RESULTS_LOG = "./results.csv"
+    SWEEP_SEED = 1
+    # The visits of all runs to every cell of the map are added to this file, None to skip counting them
+    # delete it to start a new heat map
+    VISIT_MAP = None
+    # Address to hand the batches out on, to `python cluster.py HOST:PORT` workers on any number of hosts,
+    # e.g. ("10.0.0.1", 5123). None runs them on the cores of this machine
+    # Both sides run what the other sends: the port must only be reachable on a trusted network,
+    # and the coordinator and its workers need the same secret in $CARS_AUTHKEY
+    COORDINATOR = None
+    # Total number of worker processes on all hosts, only used with a COORDINATOR
+    WORKERS = 32
     # Only required for PGMM simulations
     HEAT_MAPS = ["./heatmaps/4-circles/left-top.jpg",
                  "./heatmaps/4-circles/left-bottom.jpg",
                  "./heatmaps/4-circles/right-top.jpg",
                  "./heatmaps/4-circles/right-bottom.jpg"]
 
+    # decode every heatmap once, the forked workers share the cached grids and alias tables
+    for heat_map in HEAT_MAPS:
+        load_sampler(heat_map, sidecar=True)
+
     cpus = mp.cpu_count()
     print(f'Amount of cores available: {cpus}')
-    L = list(range(cpus))
-    chunk_size = TOTAL_SIMULATION_COUNT // cpus
-    chunks = [chunk_size for _ in range(cpus)]
-    for i in range(TOTAL_SIMULATION_COUNT % cpus):
-        chunks[i] += 1
-
-    p = mp.Pool(cpus, initargs=(mp.RLock(),))
-    results = p.map(run, [*zip(chunks, range(cpus))])
-    p.close()
-    p.join()
-
-    # Flatten all result arrays into one
-    results = [item for sublist in results for item in sublist]
-    # Remove entries where the max amount of moves was exceeded
-    results = list(filter(lambda x: x != NUM_OF_MOVES, results))
+    pool = None
+    if COORDINATOR is not None:
+        pool = Coordinator(COORDINATOR)
+        cpus = WORKERS
+        print(f'Waiting for workers on {pool.address}')
+    # workers take small batches as they become idle, so slow runs don't hold up the other cores
+    runner = Runner(VecPG2DSimulation if BATCH_MODE else PG2DSimulation, SOURCE_POS, SOURCE_TARGETS, HEAT_MAPS,
+                    batch_size=BATCH_SIZE, processes=cpus, seed=SWEEP_SEED, log=RESULTS_LOG, config=CONFIG,
+                    visits=VISIT_MAP is not None, pool=pool)
+    estimate = runner.until(TARGET_WIDTH, max_runs=TOTAL_SIMULATION_COUNT, max_seconds=MAX_SECONDS)
+    if pool is not None:
+        pool.close()
+    if VISIT_MAP is not None:
+        # the runs of earlier (resumed) sweeps are already in the file
+        if os.path.exists(VISIT_MAP):
+            runner.visits.merge(VisitMap.load(VISIT_MAP, runner.visits.mod))
+        runner.visits.save(VISIT_MAP)
 
-    print(f'min: {min(results)}, max: {max(results)}')
-    print(f'Amount of timed out simulations: {TOTAL_SIMULATION_COUNT - len(results)}, {len(results)} remain')
-    print(f'Average number of rounds: {sum(results) / len(results)}')
+    # Entries where the max amount of moves was exceeded are left out of the statistics
+    print(f'min: {estimate.min}, max: {estimate.max}')
+    print(f'Amount of timed out simulations: {estimate.timeouts}, {estimate.count} remain')
+    print(f'Average number of rounds: {estimate}')
     print("\a")  # Ring the terminal bell to indicate we're done
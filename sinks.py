@@ -0,0 +1,163 @@
+import csv
+import zlib
+
+import numpy as np
+
+
+class TraceSink:
+    """Receives the state of every car once per round
+
+    Simulation.simulate writes to its sink after every round, so full traces can
+    go straight to disk while a streaming simulation only keeps the state it
+    needs to continue.
+    """
+
+    def write(self, rd: int, cars: list) -> None:
+        assert False, "not implemented"
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class CsvTraceSink(TraceSink):
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(["round", "car", "x", "y", "when"])
+
+    def write(self, rd: int, cars: list) -> None:
+        self.writer.writerows((rd, car.index, *car.get_pos(), car.when) for car in cars)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def shuffle(block: np.ndarray) -> bytes:
+    # group the n-th bytes of every float together, the slowly changing high bytes then compress well
+    return np.ascontiguousarray(block, dtype=np.float32).view(np.uint8).reshape(-1, 4).T.tobytes()
+
+
+def unshuffle(data: bytes, num_of_cars: int) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.uint8).reshape(4, -1).T.copy().view(np.float32).reshape(-1, num_of_cars, 2)
+
+
+class BinaryTraceSink(TraceSink):
+    """Compressed trace of every car's position in every round, read back with TraceFile
+
+    Positions are stored as float32, `chunk` rounds at a time. Each chunk is
+    byte-shuffled and zlib-compressed on its own, and the chunk offsets go in
+    an index at the end of the file. A reader then gets any round by
+    decompressing just its chunk. The `when` of every car is written once, at
+    the end, the informed cars of round k are the ones with 0 <= when <= k.
+
+    Layout: MAGIC, num_of_cars and chunk (int64), the chunks, the chunk offsets
+    plus the index offset (int64), when (int32 per car) and a footer of
+    rounds, number of chunks and index offset (int64).
+    """
+
+    MAGIC = b"COTGTRC1"
+
+    def __init__(self, path: str, chunk: int = 64, level: int = 6) -> None:
+        assert 0 < chunk
+        self.file = open(path, "wb")
+        self.chunk: int = chunk
+        self.level: int = level
+        self.buffer: np.ndarray = None
+        self.filled: int = 0
+        self.rounds: int = 0
+        self.offsets: [int] = []
+        self.when: [int] = []
+
+    def start(self, num_of_cars: int) -> None:
+        self.buffer = np.empty((self.chunk, num_of_cars, 2), dtype=np.float32)
+        self.file.write(self.MAGIC + np.array([num_of_cars, self.chunk], dtype=np.int64).tobytes())
+
+    def write(self, rd: int, cars: list) -> None:
+        assert rd == self.rounds, "rounds must be written in order, starting at 0"
+        if self.buffer is None:
+            self.start(len(cars))
+        self.buffer[self.filled] = [car.get_pos() for car in cars]
+        self.when = [car.when for car in cars]
+        self.filled += 1
+        self.rounds += 1
+        if self.filled == self.chunk:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.filled:
+            self.offsets.append(self.file.tell())
+            self.file.write(zlib.compress(shuffle(self.buffer[:self.filled]), self.level))
+            self.filled = 0
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        if self.buffer is None:
+            self.start(0)
+        self.flush()
+        index = self.file.tell()
+        self.file.write(np.array(self.offsets + [index], dtype=np.int64).tobytes())
+        self.file.write(np.array(self.when, dtype=np.int32).tobytes())
+        self.file.write(np.array([self.rounds, len(self.offsets), index], dtype=np.int64).tobytes())
+        self.file.close()
+
+
+class TraceFile:
+    """Reader of a BinaryTraceSink file that never loads more than one chunk at a time
+
+    :param path: str
+        Path of the trace
+    """
+
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "rb")
+        head = self.file.read(len(BinaryTraceSink.MAGIC) + 16)
+        if not head.startswith(BinaryTraceSink.MAGIC):
+            raise ValueError(f"{path} is not a binary trace")
+        self.num_of_cars, self.chunk = map(int, np.frombuffer(head[len(BinaryTraceSink.MAGIC):], dtype=np.int64))
+        self.file.seek(-24, 2)
+        self.rounds, num_of_chunks, index = map(int, np.frombuffer(self.file.read(24), dtype=np.int64))
+        self.file.seek(index)
+        self.offsets: np.ndarray = np.frombuffer(self.file.read(8 * (num_of_chunks + 1)), dtype=np.int64)
+        self.when: np.ndarray = np.frombuffer(self.file.read(4 * self.num_of_cars), dtype=np.int32)
+        # the last chunk read, rounds are mostly read in order
+        self.cached: (int, np.ndarray) = (-1, None)
+
+    def __len__(self) -> int:
+        return self.rounds
+
+    def read_chunk(self, i: int) -> np.ndarray:
+        if self.cached[0] != i:
+            self.file.seek(self.offsets[i])
+            data = zlib.decompress(self.file.read(self.offsets[i + 1] - self.offsets[i]))
+            self.cached = (i, unshuffle(data, self.num_of_cars))
+        return self.cached[1]
+
+    def positions(self, rd: int) -> np.ndarray:
+        """(x, y) of every car at round `rd`, in car index order"""
+        if not 0 <= rd < self.rounds:
+            raise IndexError(f"round {rd} is not in the trace")
+        i, row = divmod(rd, self.chunk)
+        return self.read_chunk(i)[row]
+
+    def informed(self, rd: int) -> np.ndarray:
+        return (self.when >= 0) & (self.when <= rd)
+
+    def courses(self, index: int) -> np.ndarray:
+        """Every position of one car, one chunk at a time"""
+        return np.concatenate([self.read_chunk(i)[:, index] for i in range(len(self.offsets) - 1)])
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
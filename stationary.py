@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+
+from help import child_seed, save_array
+
+# where the sampled states are kept between runs
+STATIONARY_DIR = "./stationary"
+# number of sampled states per model, map and heatmap
+STATIONARY_SIZE = 2000
+# moves before a car's state is sampled, plus a random share of this again
+BURN_IN = 1000
+
+_states: {str: np.ndarray} = {}
+
+
+def sample_states(car, size: int = STATIONARY_SIZE, burn_in: int = BURN_IN) -> np.ndarray:
+    """Run `size` fresh cars of the same model as `car` for a long time and return their states
+
+    Every car is sampled after a random number of moves between burn_in and
+    2 * burn_in, so the states are spread over the cars' whole trajectories.
+    """
+
+    rand = np.random.default_rng(child_seed(f"stationary-{car.stationary_key()}"))
+    states = []
+    for index in range(1, size + 1):
+        sample = car.spawn(index, child_seed(f"stationary-{car.stationary_key()}", index))
+        for _ in range(burn_in + int(rand.integers(burn_in))):
+            sample.move()
+            sample.compact()
+        states.append(sample.state())
+    return np.array(states, dtype=float)
+
+
+def stationary_states(car) -> np.ndarray:
+    """Cached sample of the stationary states of `car`'s model, see Car.state
+
+    Sampled once per model, map size and heatmap, then kept in memory and as
+    an `.npy` file in STATIONARY_DIR. Call preload_stationary before starting
+    worker processes, or each of them samples the same model at once.
+    """
+
+    key = car.stationary_key()
+    if key not in _states:
+        path = os.path.join(STATIONARY_DIR, f"{key}.npy")
+        if not os.path.exists(path):
+            os.makedirs(STATIONARY_DIR, exist_ok=True)
+            save_array(path, sample_states(car))
+        _states[key] = np.load(path)
+    return _states[key]
+
+
+def preload_stationary(simulation) -> None:
+    """Sample or load the stationary states of every peer model of `simulation`
+
+    Like the heatmaps in sim.py, done once in the parent: forked workers then
+    share the states and the others find the `.npy` file.
+    """
+
+    for car in simulation.cars[1:]:
+        stationary_states(car)
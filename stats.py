@@ -0,0 +1,103 @@
+from time import perf_counter
+
+# simulation method and the phase its time is booked under
+PHASES = {"warm_up": "pre_run", "propagate": "propagate", "contact_times": "propagate",
+          "calculate_num_of_broadcasters": "count"}
+# the same for the methods the pre-run calls too, they are wrapped once it is over
+MOVES = {"cars_move": "move", "draw_targets": "set_target", "draw_steps": "set_target"}
+
+
+class PhaseStats:
+    """Opt-in timers and counters of the phases of a simulation
+
+    Set `simulation.stats = PhaseStats()` before calling simulate(). The
+    simulation then hands itself to instrument(), which wraps the phase methods
+    on that instance, so a simulation without stats runs the plain, untouched
+    methods. set_target runs inside move, its time is part of both. The moves
+    and targets of the pre-run are booked under pre_run only, in either engine. The object engine's cars report their set_target calls
+    through their `stats` slot.
+
+    Counters: runs, rounds, targets drawn, distances evaluated by the spatial
+    grid and contacts (pairs found within range). Stats of several runs or
+    pool workers are combined with merge().
+    """
+
+    def __init__(self) -> None:
+        self.seconds: {str: float} = {}
+        self.counts: {str: int} = {}
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + int(amount)
+
+    def merge(self, other: "PhaseStats") -> None:
+        for phase, seconds in other.seconds.items():
+            self.add(phase, seconds)
+        for name, amount in other.counts.items():
+            self.count(name, amount)
+
+    def timed(self, phase: str, method):
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            result = method(*args, **kwargs)
+            self.add(phase, perf_counter() - start)
+            return result
+        return timed
+
+    def counted(self, draw):
+        def counted(idx):
+            self.count("targets", len(idx))
+            return draw(idx)
+        return counted
+
+    def set_target(self, car) -> None:
+        """Car.set_target of an object engine car, timed and counting the targets it draws"""
+        start = perf_counter()
+        drawn = len(car.targets)
+        car.set_target()
+        self.count("targets", len(car.targets) - drawn)
+        self.add("set_target", perf_counter() - start)
+
+    def instrument(self, simulation) -> None:
+        # the wrappers of an earlier simulate() are dropped, so a phase is never timed or counted twice
+        for name in (*PHASES, *MOVES, "spatial_grid"):
+            vars(simulation).pop(name, None)
+        for name, phase in PHASES.items():
+            if hasattr(simulation, name):
+                setattr(simulation, name, self.timed(phase, getattr(simulation, name)))
+
+        spatial_grid = simulation.spatial_grid
+
+        def counted_grid(*args, **kwargs):
+            grid = spatial_grid(*args, **kwargs)
+            grid.stats = self
+            return grid
+        simulation.spatial_grid = counted_grid
+
+        warm_up = simulation.warm_up
+
+        def warm_up_then_moves() -> None:
+            warm_up()
+            self.instrument_moves(simulation)
+        simulation.warm_up = warm_up_then_moves
+
+    def instrument_moves(self, simulation) -> None:
+        """Time the moves and time and count the targets of the peers from now on"""
+        for name, phase in MOVES.items():
+            if hasattr(simulation, name):
+                method = self.timed(phase, getattr(simulation, name))
+                setattr(simulation, name, method if phase == "move" else self.counted(method))
+        # the source only repeats its queue, targets are drawn by the peers
+        for car in getattr(simulation, "cars", [])[1:]:
+            car.stats = self
+
+    def finish(self, runs: int, rounds: int) -> None:
+        self.count("runs", runs)
+        self.count("rounds", rounds)
+
+    def __str__(self) -> str:
+        lines = [f"{phase:>10}: {seconds:.3f}s" for phase, seconds in self.seconds.items()]
+        lines += [f"{name:>10}: {amount}" for name, amount in self.counts.items()]
+        return "\n".join(lines)
@@ -0,0 +1,26 @@
+from main import *
+from runner import Sweep
+
+
+if __name__ == '__main__':
+    # Every combination of the settings below is run on the same pool of workers
+    MODELS = [VecRWP2DSimulation, VecPG2DSimulation]
+    NUM_OF_CARS_GRID = [10, 25, 50]
+    X_MAX_GRID = [25, 50]
+    # Only required for PGMM simulations
+    HEAT_MAP_SETS = [["./heatmaps/4-circles/left-top.jpg",
+                      "./heatmaps/4-circles/left-bottom.jpg",
+                      "./heatmaps/4-circles/right-top.jpg",
+                      "./heatmaps/4-circles/right-bottom.jpg"]]
+    SOURCE_POS = (0, 0)
+    SOURCE_TARGETS = None
+    # Stop a point once the 95% confidence interval of its average is narrower than this many rounds
+    TARGET_WIDTH = 2
+    MAX_RUNS = 10000
+    RESULTS_LOG = "./sweep.csv"
+    SWEEP_SEED = 1
+
+    sweep = Sweep(MODELS, SOURCE_POS, SOURCE_TARGETS, num_of_cars=NUM_OF_CARS_GRID, x_max=X_MAX_GRID,
+                  heat_maps=HEAT_MAP_SETS, batch_size=64, seed=SWEEP_SEED, log=RESULTS_LOG)
+    for name, estimate in sweep.until(TARGET_WIDTH, max_runs=MAX_RUNS).items():
+        print(f'{name}: {estimate} ({estimate.timeouts} timed out)')
@@ -0,0 +1,616 @@
+from base import BaseSimulation
+from grid import SpatialGrid, TorSpatialGrid
+from help import *
+
+
+class VecSimulation(BaseSimulation):
+    """Array-backed counterpart of base.Simulation
+
+    Every car's position, previous target, current target and `when` live in
+    NumPy arrays, so a round is one batched step over the whole fleet instead
+    of a `car.move()` call per car. Subclasses provide `draw_targets` for the
+    mobility model and pick the spatial `grid` of the map topology.
+
+    With `replicas` > 1 the arrays hold that many independent simulations back
+    to back (car `i` of replica `r` is row `r * n + i`, see `replica_pos`).
+    Replicas never see each other, each one stops moving once its broadcaster
+    count reaches n, and `rounds` holds the per-replica round count.
+    """
+
+    def __init__(self, seed, source_pos: (int, int), source_source: [(int, int)] = None, replicas: int = 1,
+                 config: Config = None) -> None:
+        assert 0 < replicas
+        super().__init__(config, replicas)
+        self.rng: np.random.Generator = np.random.default_rng(seed_sequence(seed))
+        self.n: int = self.config.num_of_cars
+        self.replicas: int = replicas
+        self.sources: np.ndarray = np.arange(replicas) * self.n
+        self.pos: np.ndarray = self.init_positions(source_pos)
+        self.prev: np.ndarray = self.pos.copy()
+        self.target: np.ndarray = self.pos.copy()
+        self.when: np.ndarray = np.full(self.n * replicas, -1)
+        self.when[self.sources] = 0
+        self.source_queue: np.ndarray = np.array([] if source_source is None else source_source, dtype=float)
+        self.source_queue = self.source_queue.reshape(-1, 2)
+        self.source_targets: [(int, int)] = [tuple(source_pos)] + list(map(tuple, self.source_queue.tolist()))
+        self.source_idx: np.ndarray = np.zeros(replicas, dtype=int)
+        self.counts: np.ndarray = np.ones(replicas, dtype=int)
+        self.rounds: np.ndarray = np.zeros(replicas, dtype=int)
+        self.alive: np.ndarray = np.arange(self.n * replicas)
+        # keep the per-car history needed by summary(), turn off for pure Monte-Carlo runs
+        self.record: bool = replicas == 1
+        self.recording: bool = False
+        self.course_log: [(np.ndarray, np.ndarray)] = []
+        self.target_log: [(np.ndarray, np.ndarray)] = []
+
+    @property
+    def replica_pos(self) -> np.ndarray:
+        return self.pos.reshape(self.replicas, self.n, 2)
+
+    def init_positions(self, source_pos: (int, int)) -> np.ndarray:
+        pos = self.rng.uniform(0, 1, (self.n * self.replicas, 2)) * self.config.size
+        peer = np.arange(len(pos)) % self.n != 0
+        while True:
+            pos[self.sources] = source_pos
+            clash = np.flatnonzero((pos == source_pos).all(axis=1) & peer)
+            if not clash.size:
+                return pos
+            pos[clash] = self.rng.uniform(0, 1, (clash.size, 2)) * self.config.size
+
+    def spatial_grid(self, points, groups=None, radius: float = None) -> SpatialGrid:
+        radius = self.link.radio_range if radius is None else radius
+        return self.grid(points, radius=radius, groups=groups)
+
+    def draw_targets(self, idx: np.ndarray) -> np.ndarray:
+        assert False, "not implemented"
+
+    def set_source_targets(self, idx: np.ndarray) -> None:
+        replica = idx // self.n
+        queued = self.source_idx[replica] < len(self.source_queue)
+        self.target[idx[queued]] = self.source_queue[self.source_idx[replica[queued]]]
+        self.source_idx[replica[queued]] += 1
+
+        # a source that has reached its last target stays there from now on
+        parked = idx[~queued]
+        self.target[parked] = self.prev[parked]
+        if parked.size and self.replicas == 1:
+            self.source_targets.append(tuple(self.prev[0].tolist()))
+
+    def set_targets(self, idx: np.ndarray) -> None:
+        is_source = idx % self.n == 0
+        if is_source.any():
+            self.set_source_targets(idx[is_source])
+            idx = idx[~is_source]
+        if idx.size:
+            targets = self.draw_targets(idx)
+            self.target[idx] = targets
+            if self.recording:
+                self.target_log.append((idx, targets))
+
+    def cars_move(self, idx: np.ndarray) -> None:
+        active = idx
+        step = np.ones(active.size)
+        while active.size:
+            pos = self.pos[active]
+            target = self.target[active]
+            # a car that sees a repeated target stays at the current pos
+            parked = (target == self.prev[active]).all(axis=1)
+            delta = target - pos
+            dist = np.sqrt((delta ** 2).sum(axis=1))
+            reach = parked | (step >= dist)
+            moving = ~reach
+            pos[reach] = target[reach]
+            pos[moving] += delta[moving] * step[moving, None] / dist[moving, None]
+            self.pos[active] = pos
+            if self.recording:
+                self.course_log.append((active, pos))
+
+            arrived = reach & ~parked
+            step = step[arrived] - dist[arrived]
+            active = active[arrived]
+            self.prev[active] = self.target[active]
+            self.set_targets(active)
+            active = active[step > 0]
+            step = step[step > 0]
+
+    def propagate(self, rd: int) -> None:
+        informed = self.when[self.alive] >= 0
+        uninformed = self.alive[~informed]
+        if not uninformed.size:
+            return
+        if self.messages is not None:
+            self.spread(rd)
+            return
+        broadcasters = self.alive[informed]
+        grid = self.spatial_grid(self.pos[broadcasters], groups=broadcasters // self.n)
+        contacts = grid.count_within(self.pos[uninformed], groups=uninformed // self.n)
+        if self.link.instant:
+            self.when[uninformed[contacts > 0]] = rd
+            return
+        streak = self.link.transmit(contacts, self.streak[uninformed], self.rng)
+        self.streak[uninformed] = streak
+        self.when[uninformed[self.link.received(streak)]] = rd
+
+    def start_messages(self) -> None:
+        origins = np.array(self.config.origins)
+        self.messages = np.full((len(self.pos), len(origins)), -1)
+        self.messages[self.sources[:, None] + origins, np.arange(len(origins))] = 0
+        self.streak = np.zeros(self.messages.shape, dtype=np.int64)
+        self.when = np.where((self.messages >= 0).all(axis=1), 0, -1)
+
+    def spread(self, rd: int) -> None:
+        """propagate for several messages, the contacts of the round are found once for all of them"""
+        alive = self.alive
+        groups = alive // self.n
+        query_idx, point_idx = self.spatial_grid(self.pos[alive], groups=groups).pairs(self.pos[alive], groups)
+        messages, streak = self.messages[alive], self.streak[alive]
+        self.link.spread(messages, streak, query_idx, point_idx, self.rng, rd)
+        self.messages[alive], self.streak[alive] = messages, streak
+        known = (messages >= 0).all(axis=1) & (self.when[alive] < 0)
+        self.when[alive[known]] = rd
+
+    def message_rounds(self) -> np.ndarray:
+        """(replicas, M) round in which the last car of a replica got each message, -1 if it did not reach every car"""
+        messages = self.when[:, None] if self.messages is None else self.messages
+        messages = messages.reshape(self.replicas, self.n, -1)
+        return np.where((messages >= 0).all(axis=1), messages.max(axis=1), -1)
+
+    def quiet_rounds(self) -> int:
+        """Number of upcoming rounds in which no car can possibly be informed, 0 if unknown"""
+        return 0
+
+    def calculate_num_of_broadcasters(self) -> None:
+        informed = (self.when >= 0).reshape(self.replicas, self.n)
+        self.counts = np.count_nonzero(informed, axis=1)
+        if self.replicas == 1:
+            self.num_of_broadcasters.append(int(self.counts[0]))
+
+    def calculate_neighbor_percentage(self) -> None:
+        groups = np.arange(len(self.pos)) // self.n
+        num_of_nbrs = self.spatial_grid(self.pos, groups=groups).count_within(self.pos, groups=groups).sum()
+        num_of_nbrs -= len(self.pos)  # minus itself
+        self.neighbor_percentage.append(float(num_of_nbrs / self.n / self.n / self.replicas))
+
+    def count_visits(self) -> None:
+        if self.visits is not None:
+            alive = self.alive
+            self.visits.add(self.pos[alive[alive % self.n != 0]])
+
+    def warm_up(self) -> None:
+        everyone = np.arange(len(self.pos))
+        self.set_targets(everyone)
+        peers = everyone[everyone % self.n != 0]
+        for _ in range(self.config.pre_run_count):
+            self.cars_move(peers)
+
+    def truncate(self) -> None:
+        peers = np.flatnonzero(np.arange(len(self.pos)) % self.n != 0)
+        self.course_log = [(np.arange(len(self.pos)), self.pos.copy())]
+        self.target_log = [(peers, self.prev[peers]), (peers, self.target[peers])]
+        self.recording = self.record
+
+    def simulate(self) -> int:
+        # the stationary samples are states of the object engine's cars, see stationary.py
+        assert not self.config.stationary_start, "the vectorized engines only warm up with the pre-run"
+        if self.stats is not None:
+            self.stats.instrument(self)
+        self.warm_up()
+        self.truncate()
+        everyone = np.arange(len(self.pos))
+        if self.config.origins != ORIGINS:
+            self.start_messages()
+        self.calculate_num_of_broadcasters()
+        if self.track_neighbors:
+            self.calculate_neighbor_percentage()
+        self.count_visits()
+
+        rd = 1
+        running = self.counts != self.n
+        while running.any():
+            # rounds in which nobody can be informed only need the move step
+            quiet = self.quiet_rounds()
+            if not self.config.exceed_moves:
+                quiet = min(quiet, self.config.num_of_moves - rd)
+            for _ in range(quiet):
+                self.cars_move(self.alive)
+                self.count_visits()
+            if quiet:
+                # nobody was in range in these rounds, so every transmission starts over
+                self.streak[self.alive] = 0
+                if self.replicas == 1:
+                    self.num_of_broadcasters.extend([int(self.counts[0])] * quiet)
+                rd += quiet
+            self.cars_move(self.alive)
+            self.propagate(rd)
+            self.calculate_num_of_broadcasters()
+            if self.track_neighbors:
+                self.calculate_neighbor_percentage()
+            self.count_visits()
+            self.rounds[running] = rd
+            if not self.config.exceed_moves and rd == self.config.num_of_moves:
+                break
+            # finished replicas are frozen and drop out of every later round
+            if (self.counts[running] == self.n).any():
+                running = self.counts != self.n
+                self.alive = everyone[np.repeat(running, self.n)]
+            rd += 1
+        if self.stats is not None:
+            self.stats.finish(self.replicas, int(self.rounds.sum()))
+        return rd
+
+    @staticmethod
+    def unpack(log: [(np.ndarray, np.ndarray)], n: int) -> [[(float, float)]]:
+        if not log:
+            return [[] for _ in range(n)]
+        idx = np.concatenate([entry[0] for entry in log])
+        xys = np.concatenate([entry[1] for entry in log])
+        order = np.argsort(idx, kind="stable")
+        bounds = np.cumsum(np.bincount(idx, minlength=n))[:-1]
+        return [list(map(tuple, part.tolist())) for part in np.split(xys[order], bounds)]
+
+    def summary(self) -> ([(int, int)], [(int, int)], int, int):
+        assert self.replicas == 1, "summary() is only kept for single runs"
+        courses = self.unpack(self.course_log, self.n)
+        targets = self.unpack(self.target_log, self.n)
+        targets[0] = list(self.source_targets)
+        return courses, targets, self.num_of_broadcasters, self.neighbor_percentage
+
+
+class VecSynSimulation(VecSimulation):
+    grid = SpatialGrid
+
+
+class VecTorSynSimulation(VecSimulation):
+    grid = TorSpatialGrid
+
+    def spatial_grid(self, points, groups=None, radius: float = None) -> TorSpatialGrid:
+        radius = self.link.radio_range if radius is None else radius
+        return self.grid(points, radius=radius, groups=groups, size=self.config.size)
+
+
+class VecMGSimulation(VecSimulation):
+    """Lattice counterpart of SynMGCar, for the Manhattan grid models
+
+    Positions are integer lattice points and every peer takes one step per
+    round, never straight back. A car and a peer get at most two steps closer
+    per round (one step plus the source's longest jump for the source), so
+    from the Manhattan gap between every uninformed car and every broadcaster
+    quiet_rounds knows how many rounds can pass without any contact. Only the
+    gap to the nearest broadcasters matters, which the spatial grid finds.
+    Those rounds are only moved, not propagated or counted, which gives the
+    same rounds-to-full-broadcast distribution at a fraction of the work in
+    sparse fleets. The bound needs every position on the lattice, so the
+    source and its targets must be integer points.
+    """
+
+    # wrap around the X_MAX x Y_MAX torus (MG3D) instead of stopping at the edges (MG2D)
+    torus: bool = False
+    # -x, +x, -y, +y, the opposite of direction d is d ^ 1
+    steps: np.ndarray = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)])
+    # most quiet rounds proven at once, it sets the radius of the search for nearby broadcasters
+    quiet_horizon: int = 16
+
+    def __init__(self, seed, source_pos: (int, int), source_source: [(int, int)] = None, replicas: int = 1,
+                 config: Config = None) -> None:
+        super().__init__(seed, source_pos, source_source, replicas, config)
+        path = np.concatenate([np.array([source_pos], dtype=float), self.source_queue])
+        assert (path == np.round(path)).all(), "the source and its targets must be lattice points"
+        self.source_speed: float = float(np.abs(np.diff(path, axis=0)).sum(axis=1).max(initial=0))
+        # rounds to wait before the next quiet_rounds search, and the wait after the next empty one
+        self.quiet_wait: int = 0
+        self.quiet_backoff: int = 1
+
+    @property
+    def reach(self) -> int:
+        """Largest Manhattan gap between two lattice points that are within range"""
+        r = self.link.radio_range
+        return max(dx + math.isqrt(math.floor(r * r) - dx * dx) for dx in range(math.floor(r) + 1))
+
+    @property
+    def lattice(self) -> np.ndarray:
+        size = np.array(self.config.size)
+        return size if self.torus else size + 1
+
+    def init_positions(self, source_pos: (int, int)) -> np.ndarray:
+        pos = self.rng.integers(0, self.lattice, (self.n * self.replicas, 2))
+        peer = np.arange(len(pos)) % self.n != 0
+        while True:
+            pos[self.sources] = source_pos
+            clash = np.flatnonzero((pos == source_pos).all(axis=1) & peer)
+            if not clash.size:
+                return pos
+            pos[clash] = self.rng.integers(0, self.lattice, (clash.size, 2))
+
+    def set_targets(self, idx: np.ndarray) -> None:
+        # the next lattice step is drawn in cars_move
+        pass
+
+    def draw_steps(self, idx: np.ndarray) -> np.ndarray:
+        pos = self.pos[idx]
+        options = pos[:, None, :] + self.steps[None, :, :]
+        if self.torus:
+            options %= self.lattice
+            valid = np.ones(options.shape[:2], dtype=bool)
+        else:
+            valid = ((options >= 0) & (options < self.lattice)).all(axis=-1)
+        weights = valid / valid.sum(axis=1, keepdims=True)
+
+        # never step back to the previous position, its weight goes to the opposite
+        # direction or, if that one is off the map, is spread over the others
+        back = (options == self.prev[idx][:, None, :]).all(axis=-1)
+        back_weight = (weights * back).sum(axis=1)
+        weights[back] = 0
+        opposite = back[:, [1, 0, 3, 2]] & valid
+        weights += opposite * back_weight[:, None]
+        spread = (back_weight > 0) & ~opposite.any(axis=1)
+        others = weights[spread] > 0
+        weights[spread] += others * (back_weight[spread] / others.sum(axis=1))[:, None]
+
+        bounds = np.cumsum(weights, axis=1)
+        choice = (self.rng.random(idx.size)[:, None] * bounds[:, -1:] >= bounds).sum(axis=1)
+        return options[np.arange(idx.size), np.minimum(choice, 3)]
+
+    def cars_move(self, idx: np.ndarray) -> None:
+        is_source = idx % self.n == 0
+        sources, peers = idx[is_source], idx[~is_source]
+        if sources.size:
+            replica = sources // self.n
+            queued = self.source_idx[replica] < len(self.source_queue)
+            self.prev[sources] = self.pos[sources]
+            self.pos[sources[queued]] = self.source_queue[self.source_idx[replica[queued]]]
+            if self.replicas == 1 and self.source_idx[0] == len(self.source_queue):
+                # the source has reached its last target and stays there from now on
+                self.source_targets.append(tuple(self.pos[0].tolist()))
+            self.source_idx[replica] += 1
+        if peers.size:
+            steps = self.draw_steps(peers)
+            self.prev[peers] = self.pos[peers]
+            self.pos[peers] = steps
+            if self.recording:
+                self.target_log.append((peers, steps))
+        if self.recording:
+            self.course_log.append((idx, self.pos[idx]))
+
+    def truncate(self) -> None:
+        peers = np.flatnonzero(np.arange(len(self.pos)) % self.n != 0)
+        self.course_log = [(np.arange(len(self.pos)), self.pos.copy())]
+        self.target_log = [(peers, self.pos[peers])]
+        self.recording = self.record
+
+    def quiet_rounds(self) -> int:
+        # with several messages any two cars may have something to pass on
+        if self.track_neighbors or self.messages is not None:
+            return 0
+        # in a dense fleet every search comes up empty and costs about as much as the round it tries
+        # to skip, so after an empty one wait twice as long (up to quiet_horizon rounds) before the next
+        if self.quiet_wait:
+            self.quiet_wait -= 1
+            return 0
+        rounds = min(self.source_quiet_rounds(), self.peer_quiet_rounds())
+        if rounds:
+            self.quiet_backoff = 1
+        else:
+            self.quiet_wait = self.quiet_backoff
+            self.quiet_backoff = min(2 * self.quiet_backoff, self.quiet_horizon)
+        return rounds
+
+    def gaps(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Manhattan gap between the lattice points a and b"""
+        gap = np.abs(a - b)
+        if self.torus:
+            gap %= self.lattice
+            gap = np.minimum(gap, self.lattice - gap)
+        return gap.sum(axis=-1)
+
+    def bound(self, gap: np.ndarray, closing: float) -> int:
+        # a pair at gap d is within range after t rounds only if d - closing * t <= reach
+        rounds = np.ceil((gap - self.reach) / closing) - 1
+        return int(max(rounds.min(initial=self.quiet_horizon), 0))
+
+    def source_quiet_rounds(self) -> int:
+        """Quiet rounds between every source and the peers it could inform or be informed by"""
+        # alive holds whole replicas, so it reshapes to (replicas, n)
+        alive = self.alive.reshape(-1, self.n)
+        informed = self.when[alive] >= 0
+        others = informed[:, 1:] != informed[:, :1]
+        gap = self.gaps(self.pos[alive[:, 1:]], self.pos[alive[:, :1]])
+        return self.bound(gap[others], 1 + self.source_speed)
+
+    def peer_quiet_rounds(self) -> int:
+        """Quiet rounds between the uninformed peers and their nearest informed peers"""
+        alive = self.alive[self.alive % self.n != 0]
+        informed = self.when[alive] >= 0
+        broadcasters, uninformed = alive[informed], alive[~informed]
+        if not broadcasters.size or not uninformed.size:
+            return self.quiet_horizon
+        # the Manhattan gap is at least the distance, a pair the grid does not find is more than
+        # reach + 2 * quiet_horizon apart and stays out of range for quiet_horizon rounds
+        grid = self.spatial_grid(self.pos[broadcasters], groups=broadcasters // self.n,
+                                 radius=self.reach + 2 * self.quiet_horizon)
+        query_idx, point_idx = grid.pairs(self.pos[uninformed], groups=uninformed // self.n)
+        return self.bound(self.gaps(self.pos[uninformed[query_idx]], self.pos[broadcasters[point_idx]]), 2)
+
+
+class EventSimulation(VecSimulation):
+    """Continuous-time engine for the unit-speed straight-line models (RWP, RD)
+
+    Every car keeps its current segment (start point, start time, direction,
+    arrival time). Instead of stepping round by round, each replica jumps to its
+    next event, the earliest waypoint arrival or the earliest moment an
+    uninformed car comes within range of a broadcaster. The closest approach
+    of two segments is a quadratic in time, so contacts that happen between
+    rounds are caught too. A car informed at time t has `when` = ceil(t) and
+    passes the message on at once.
+
+    Every uninformed car keeps its earliest contact and the broadcaster it is
+    with. An event only changes the segment or the state of a few cars, so
+    only their pairs are evaluated again, against the cars the spatial grid
+    finds within reach before either segment changes.
+
+    Reuses draw_targets of the Vec* mobility models, e.g.
+    `class EventRWP2DSimulation(EventSimulation, VecRWP2DSimulation)`.
+    """
+
+    # wrap around the X_MAX x Y_MAX torus (RWP3D)
+    torus: bool = False
+    images: np.ndarray = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+
+    def start_segments(self, idx: np.ndarray, start: np.ndarray) -> None:
+        self.start[idx] = start
+        delta = self.target[idx] - self.pos[idx]
+        length = np.sqrt((delta ** 2).sum(axis=1))
+        # a car that sees a repeated target stays at the current pos
+        parked = (self.target[idx] == self.prev[idx]).all(axis=1) | (length == 0)
+        self.velocity[idx] = np.where(parked[:, None], 0, delta / np.where(parked, 1, length)[:, None])
+        self.arrival[idx] = np.where(parked, np.inf, start + length)
+
+    def positions(self, rows: np.ndarray, now: np.ndarray) -> np.ndarray:
+        # pos holds the start point of every car's segment while simulate runs, now has the shape of rows
+        return self.pos[rows] + self.velocity[rows] * (now - self.start[rows])[..., None]
+
+    def contact_times(self, offset: np.ndarray, relative: np.ndarray, window: np.ndarray) -> np.ndarray:
+        """Earliest time (from now) at which the cars of a pair are within range, inf if not within the window
+
+        :param offset: (P, 2) position of one car of every pair minus the other's
+        :param relative: (P, 2) velocity of one car of every pair minus the other's
+        :param window: (P,) time until either segment changes
+        """
+
+        if self.torus:
+            # the window is at most a quarter of the map, the nearest images then suffice
+            size = np.array(self.config.size, dtype=float)
+            offset = (offset + size / 2) % size - size / 2
+            offset = offset[:, None, :] + self.images * size
+            relative = relative[:, None, :]
+        a = (relative ** 2).sum(axis=-1)
+        b = 2 * (offset * relative).sum(axis=-1)
+        c = (offset ** 2).sum(axis=-1) - self.link.radio_range ** 2
+        disc = b * b - 4 * a * c
+        with np.errstate(divide="ignore", invalid="ignore"):
+            entry = (-b - np.sqrt(disc)) / (2 * a)
+        times = np.where(c <= 0, 0, np.where((disc >= 0) & (a > 0) & (entry >= 0), entry, np.inf))
+        if self.torus:
+            times = times.min(axis=-1)
+        return np.where(times <= window, times, np.inf)
+
+    def nearby(self, cars: np.ndarray, others: np.ndarray, now: np.ndarray,
+               deadline: float) -> (np.ndarray, np.ndarray):
+        """(car, other) pairs of a replica that may come within range before the car's segment changes"""
+        if not cars.size or not others.size:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        t = now[cars // self.n]
+        points, queries = self.positions(cars, t), self.positions(others, now[others // self.n])
+        # both cars move at unit speed, so they close in at most twice as fast
+        reach = self.link.radio_range + 2 * (np.minimum(self.refresh[cars], deadline) - t).max()
+        # no pair is further apart than the box around all of them, which holds the source even off the map
+        corners = np.concatenate([points, queries])
+        span = float(np.hypot(*(corners.max(axis=0) - corners.min(axis=0))))
+        grid = self.spatial_grid(points, groups=cars // self.n, radius=min(reach, max(span, self.link.radio_range)))
+        other_idx, car_idx = grid.pairs(queries, groups=others // self.n)
+        return cars[car_idx], others[other_idx]
+
+    def update_contacts(self, changed: np.ndarray, now: np.ndarray, deadline: float) -> None:
+        """Find the earliest contacts again after the segment or state of the `changed` cars changed"""
+        informed = self.when[self.alive] >= 0
+        uninformed, broadcasters = self.alive[~informed], self.alive[informed]
+        is_changed = np.zeros(len(self.pos), dtype=bool)
+        is_changed[changed] = True
+        # an uninformed car whose earliest contact was with a changed broadcaster looks at all of them again
+        is_changed[uninformed[is_changed[self.partner[uninformed]]]] = True
+        looking = uninformed[is_changed[uninformed]]
+        self.contact[looking] = np.inf
+        self.partner[looking] = looking
+
+        found_b, found_u = self.nearby(broadcasters[is_changed[broadcasters]], uninformed, now, deadline)
+        looking_u, looking_b = self.nearby(looking, broadcasters, now, deadline)
+        cars = np.concatenate([found_u, looking_u])
+        partners = np.concatenate([found_b, looking_b])
+        t = now[cars // self.n]
+        # a pair's segments hold until either car's next refresh
+        window = np.minimum(np.minimum(self.refresh[cars], self.refresh[partners]), deadline) - t
+        times = t + self.contact_times(self.positions(cars, t) - self.positions(partners, t),
+                                       self.velocity[cars] - self.velocity[partners], window)
+
+        # keep the earliest contact of every uninformed car
+        order = np.lexsort((times, cars))
+        cars, partners, times = cars[order], partners[order], times[order]
+        first = np.r_[True, cars[1:] != cars[:-1]] if cars.size else np.zeros(0, dtype=bool)
+        cars, partners, times = cars[first], partners[first], times[first]
+        closer = times < self.contact[cars]
+        self.contact[cars[closer]] = times[closer]
+        self.partner[cars[closer]] = partners[closer]
+
+    def simulate(self) -> int:
+        # the cars only move between events, there are no rounds to count visits in
+        assert self.visits is None, "visits are not counted by the event engine"
+        assert not self.track_neighbors, "neighbors are not counted by the event engine"
+        # a contact is a moment, not a number of rounds a try can fail or last for
+        assert self.link.instant, "the event engine only has instant, lossless links"
+        assert self.config.origins == ORIGINS, "the event engine only spreads the source's message"
+        assert not self.config.stationary_start, "the event engine only warms up with the pre-run"
+        if self.stats is not None:
+            self.stats.instrument(self)
+        self.warm_up()
+        self.truncate()
+        everyone = np.arange(len(self.pos))
+
+        self.start: np.ndarray = np.zeros(len(self.pos))
+        self.velocity: np.ndarray = np.zeros_like(self.pos)
+        self.arrival: np.ndarray = np.zeros(len(self.pos))
+        self.start_segments(everyone, np.zeros(len(self.pos)))
+        now = np.zeros(self.replicas)
+        running = np.ones(self.replicas, dtype=bool)
+        horizon = min(self.config.size) / 4 if self.torus else np.inf
+        deadline = np.inf if self.config.exceed_moves else self.config.num_of_moves
+        # time every car's pairs are evaluated again, its arrival or, on the torus, the horizon
+        self.refresh: np.ndarray = np.minimum(self.arrival, horizon)
+        # earliest contact of every uninformed car with a broadcaster, and that broadcaster (itself if none)
+        self.contact: np.ndarray = np.full(len(self.pos), np.inf)
+        self.partner: np.ndarray = everyone.copy()
+        self.update_contacts(everyone, now, deadline)
+
+        while running.any():
+            replicas = np.flatnonzero(running)
+            rows = self.alive.reshape(-1, self.n)
+            t_next = np.minimum(np.minimum(self.refresh[rows], self.contact[rows]).min(axis=1), deadline)
+
+            # inform every car whose contact is the event, they pass it on from now on
+            hit = rows[self.contact[rows] <= t_next[:, None]]
+            self.when[hit] = np.maximum(np.ceil(self.contact[hit]), 1).astype(int)
+            self.contact[hit] = np.inf
+            self.partner[hit] = hit
+
+            # start the next segment of every car that arrived at its waypoint
+            refreshed = rows[self.refresh[rows] <= t_next[:, None]]
+            arrived = rows[self.arrival[rows] <= t_next[:, None]]
+            if arrived.size:
+                self.pos[arrived] = self.target[arrived]
+                self.prev[arrived] = self.target[arrived]
+                if self.recording:
+                    self.course_log.append((arrived, self.pos[arrived].copy()))
+                self.set_targets(arrived)
+                self.start_segments(arrived, self.arrival[arrived])
+            now[replicas] = t_next
+            self.refresh[refreshed] = np.minimum(self.arrival[refreshed], now[refreshed // self.n] + horizon)
+
+            # a replica is done once every car is informed or it ran out of time
+            informed = self.when[rows] >= 0
+            done = informed.all(axis=1)
+            self.rounds[replicas[done]] = self.when[rows[done]].max(axis=1)
+            timed_out = ~done & (t_next >= deadline)
+            self.rounds[replicas[timed_out]] = self.config.num_of_moves
+            if (done | timed_out).any():
+                running[replicas[done | timed_out]] = False
+                self.alive = everyone[np.repeat(running, self.n)]
+
+            changed = np.concatenate([hit, refreshed])
+            self.update_contacts(changed[running[changed // self.n]], now, deadline)
+
+        self.pos = self.positions(everyone.reshape(-1, self.n), now[:, None]).reshape(-1, 2)
+        self.counts = np.count_nonzero((self.when >= 0).reshape(self.replicas, self.n), axis=1)
+        if self.replicas == 1:
+            self.num_of_broadcasters = [int(np.count_nonzero((self.when >= 0) & (self.when <= rd)))
+                                        for rd in range(self.rounds[0] + 1)]
+        if self.stats is not None:
+            self.stats.finish(self.replicas, int(self.rounds.sum()))
+        return int(self.rounds.max())
@@ -1,9 +1,14 @@
+import multiprocessing as mp
+import os
+
 import matplotlib.lines as mlines
 import matplotlib.pyplot as plt
 import numpy as np
+from matplotlib.animation import FFMpegWriter, FuncAnimation, PillowWriter
 
 from base import Simulation
-from help import unzip, X_MAX, Y_MAX, fig_size, NUM_OF_CARS, NUM_OF_MOVES, get_dist
+from help import VisitMap, unzip, fig_size, get_dist, split_evenly
+from sinks import TraceFile
 
 
 class GUI:
@@ -24,22 +29,24 @@ class GUI:
 class GUIFinalPos(GUI):
     def __init__(self, sim: Simulation, mod, solo: bool) -> None:
         self.sim: Simulation = sim
+        x_max, y_max = self.sim.config.size
         self.mod = mod
         self.solo: bool = solo
         if solo:
             self.fig = plt.figure(figsize=fig_size)
         else:
             self.fig = plt.figure(figsize=(fig_size[0] * 2, fig_size[1]))
-            self.ax1 = self.fig.add_subplot(121, xlim=[0, X_MAX], ylim=[0, Y_MAX])
-            self.ax1.set_xticks(np.arange(0, X_MAX + 1, 5))
-            self.ax1.set_yticks(np.arange(0, Y_MAX + 1, 5))
+            self.ax1 = self.fig.add_subplot(121, xlim=[0, x_max], ylim=[0, y_max])
+            self.ax1.set_xticks(np.arange(0, x_max + 1, 5))
+            self.ax1.set_yticks(np.arange(0, y_max + 1, 5))
 
     def draw(self) -> None:
+        x_max, y_max = self.sim.config.size
         # draw all final positions:
         for car in self.sim.cars:
             fx, fy = car.courses[-1]
             if self.mod:
-                self.ax1.plot(fx % X_MAX, fy % X_MAX, "go", markersize=2)
+                self.ax1.plot(fx % x_max, fy % x_max, "go", markersize=2)
             else:
                 self.ax1.plot(fx, fy, "go", markersize=2)
 
@@ -48,9 +55,9 @@ class GUIFinalPos(GUI):
         #     self.ax1.plot(*unzip(car.targets[1:], False), "ro", markersize=2)
 
         source_courses = self.sim.cars[0].courses
-        self.ax1.plot(*unzip(source_courses, self.mod), "bo", markersize=2)
+        self.ax1.plot(*unzip(source_courses, self.mod, self.sim.config.size), "bo", markersize=2)
         source_targets = self.sim.cars[0].targets
-        self.ax1.plot(*unzip(source_targets, self.mod), "ro", markersize=4)
+        self.ax1.plot(*unzip(source_targets, self.mod, self.sim.config.size), "ro", markersize=4)
 
         self.ax1.set_xlabel("x axis", fontdict={"size": 12})
         self.ax1.set_ylabel("y axis", fontdict={"size": 12})
@@ -65,29 +72,23 @@ class GUIFinalPos(GUI):
 class GUIHeatMap(GUIFinalPos):
     def __init__(self, sim: Simulation, mod, solo):
         super().__init__(sim, mod, solo)
+        x_max, y_max = self.sim.config.size
         if not solo:
             self.ax3 = self.fig.add_subplot(122)
         else:
             self.ax3 = self.fig.add_subplot(111)
-        self.ax3.set_xticks(np.arange(0, X_MAX + 1, 5))
-        self.ax3.set_yticks(np.arange(0, Y_MAX + 1, 5))
+        self.ax3.set_xticks(np.arange(0, x_max + 1, 5))
+        self.ax3.set_yticks(np.arange(0, y_max + 1, 5))
 
     def draw(self):
+        x_max, y_max = self.sim.config.size
         if not self.solo:
             super().draw()
 
-        hot_map = [[0 for _ in range(X_MAX + 1)] for _ in range(Y_MAX + 1)]
+        visits = VisitMap(self.sim.config.size, self.mod)
         for car in self.sim.cars[1:]:
-            for target in car.courses:
-                if self.mod:
-                    int_target_x = int(target[0]) % X_MAX
-                    int_target_y = int(target[1]) % Y_MAX
-                else:
-                    int_target_x = int(target[0])
-                    int_target_y = int(target[1])
-                hot_map[int_target_y][int_target_x] += 1
-        # hot_map = list(reversed(hot_map))
-        im = self.ax3.imshow(hot_map)
+            visits.add(car.courses.numpy())
+        im = self.ax3.imshow(visits.counts)
         c_bar = self.fig.colorbar(im, ax=self.ax3)
         c_bar.ax.set_ylabel("frequencies", rotation=-90, va="bottom", fontsize=20)
         self.ax3.set_title("the heat map of all cars' paths", fontsize=20)
@@ -96,11 +97,13 @@ class GUIHeatMap(GUIFinalPos):
 class GUINumBro(GUIFinalPos):
     def __init__(self, sim: Simulation, mod, solo):
         super().__init__(sim, mod, solo)
-        x_max = NUM_OF_MOVES if len(self.sim.num_of_broadcasters) <= NUM_OF_MOVES else len(self.sim.num_of_broadcasters)
+        num_of_cars = self.sim.config.num_of_cars
+        num_of_moves = self.sim.config.num_of_moves
+        x_max = num_of_moves if len(self.sim.num_of_broadcasters) <= num_of_moves else len(self.sim.num_of_broadcasters)
         if not solo:
-            self.ax3 = self.fig.add_subplot(122, xlim=[x_max - 500, x_max], ylim=[0, NUM_OF_CARS])
+            self.ax3 = self.fig.add_subplot(122, xlim=[x_max - 500, x_max], ylim=[0, num_of_cars])
         else:
-            self.ax3 = self.fig.add_subplot(111, xlim=[x_max - 500, x_max], ylim=[0, NUM_OF_CARS])
+            self.ax3 = self.fig.add_subplot(111, xlim=[x_max - 500, x_max], ylim=[0, num_of_cars])
 
     def draw(self):
         if not self.solo:
@@ -118,10 +121,11 @@ class GUINumBro(GUIFinalPos):
 class GUINumNei(GUIFinalPos):
     def __init__(self, sim: Simulation, mod, solo):
         super().__init__(sim, mod, solo)
+        num_of_moves = self.sim.config.num_of_moves
         if not solo:
-            self.ax2 = self.fig.add_subplot(122, xlim=[0, NUM_OF_MOVES], ylim=[0, 0.002])
+            self.ax2 = self.fig.add_subplot(122, xlim=[0, num_of_moves], ylim=[0, 0.002])
         else:
-            self.ax2 = self.fig.add_subplot(111, xlim=[0, NUM_OF_MOVES], ylim=[0, 0.002])
+            self.ax2 = self.fig.add_subplot(111, xlim=[0, num_of_moves], ylim=[0, 0.002])
 
     def draw(self):
         if not self.solo:
@@ -137,28 +141,30 @@ class GUISnapshot(GUI):
         assert count in [6, 12, 150]
         assert interval > 0
         self.sim = sim
+        x_max, y_max = self.sim.config.size
         self.axs = []
         self.interval = interval
         if count == 6:
             self.fig = plt.figure(figsize=(fig_size[0] * 4, fig_size[1] * 2))
             for i in range(6):
-                axi = self.fig.add_subplot(2, 3, i + 1, xlim=[0, X_MAX], ylim=[0, Y_MAX])
+                axi = self.fig.add_subplot(2, 3, i + 1, xlim=[0, x_max], ylim=[0, y_max])
                 self.axs.append(axi)
         elif count == 12:
             self.fig = plt.figure(figsize=(fig_size[0] * 3, fig_size[1] * 4))
             for i in range(12):
-                axi = self.fig.add_subplot(4, 3, i + 1, xlim=[0, X_MAX], ylim=[0, Y_MAX])
+                axi = self.fig.add_subplot(4, 3, i + 1, xlim=[0, x_max], ylim=[0, y_max])
                 self.axs.append(axi)
         else:
             self.fig = plt.figure(figsize=(fig_size[0] * 10, fig_size[1] * 15))
             for i in range(150):
-                axi = self.fig.add_subplot(15, 10, i + 1, xlim=[0, X_MAX], ylim=[0, Y_MAX])
+                axi = self.fig.add_subplot(15, 10, i + 1, xlim=[0, x_max], ylim=[0, y_max])
                 self.axs.append(axi)
         for axi in self.axs:
-            axi.set_xticks(np.arange(0, X_MAX + 1, 5))
-            axi.set_yticks(np.arange(0, Y_MAX + 1, 5))
+            axi.set_xticks(np.arange(0, x_max + 1, 5))
+            axi.set_yticks(np.arange(0, y_max + 1, 5))
 
     def draw(self):
+        x_max, y_max = self.sim.config.size
         for i, axi in enumerate(self.axs):
             target_length = i * self.interval
 
@@ -172,8 +178,8 @@ class GUISnapshot(GUI):
             else:
                 raise Exception
             xys = list(zip(*source_courses))
-            xs = list(map(lambda x: x % X_MAX, list(xys[0])))
-            ys = list(map(lambda y: y % Y_MAX, list(xys[1])))
+            xs = list(map(lambda x: x % x_max, list(xys[0])))
+            ys = list(map(lambda y: y % y_max, list(xys[1])))
             self.axs[i].plot(xs, ys, "bo", markersize=2)
             self.axs[i].grid(True)
 
@@ -182,8 +188,8 @@ class GUISnapshot(GUI):
                 for j, pos in enumerate(car.courses[1:]):
                     acc_length += get_dist(*pos, *car.courses[j])
                     if acc_length >= target_length:
-                        x = pos[0] % X_MAX
-                        y = pos[1] % Y_MAX
+                        x = pos[0] % x_max
+                        y = pos[1] % y_max
                         if car.when <= i * self.interval:
                             self.axs[i].plot(x, y, "go", markersize=4)
                         else:
@@ -194,13 +200,15 @@ class GUISnapshot(GUI):
 class GUISnapshot2(GUI):
     def __init__(self, sim: Simulation, rd=1):
         self.sim = sim
+        x_max, y_max = self.sim.config.size
         self.i = rd
         self.fig = plt.figure(figsize=fig_size)
-        self.axi = self.fig.add_subplot(1, 1, 1, xlim=[0, X_MAX], ylim=[0, Y_MAX])
-        self.axi.set_xticks(np.arange(0, X_MAX + 1, 5))
-        self.axi.set_yticks(np.arange(0, Y_MAX + 1, 5))
+        self.axi = self.fig.add_subplot(1, 1, 1, xlim=[0, x_max], ylim=[0, y_max])
+        self.axi.set_xticks(np.arange(0, x_max + 1, 5))
+        self.axi.set_yticks(np.arange(0, y_max + 1, 5))
 
     def draw(self):
+        x_max, y_max = self.sim.config.size
         i = self.i
         target_length = i
 
@@ -214,8 +222,8 @@ class GUISnapshot2(GUI):
         else:
             raise Exception
         xys = list(zip(*source_courses))
-        xs = list(map(lambda x: x % X_MAX, list(xys[0])))
-        ys = list(map(lambda y: y % Y_MAX, list(xys[1])))
+        xs = list(map(lambda x: x % x_max, list(xys[0])))
+        ys = list(map(lambda y: y % y_max, list(xys[1])))
         self.axi.plot(xs, ys, "bo", markersize=4)
         self.axi.grid(True)
 
@@ -224,10 +232,83 @@ class GUISnapshot2(GUI):
             for j, pos in enumerate(car.courses[1:]):
                 acc_length += get_dist(*pos, *car.courses[j])
                 if acc_length >= target_length:
-                    x = pos[0] % X_MAX
-                    y = pos[1] % Y_MAX
+                    x = pos[0] % x_max
+                    y = pos[1] % y_max
                     if car.when <= i:
                         self.axi.plot(x, y, "go", markersize=8)
                     else:
                         self.axi.plot(x, y, "ro", markersize=8)
                     break
+
+
+class GUIAnimation(GUI):
+    """Frames of a run recorded with a BinaryTraceSink, in the style of GUISnapshot2
+
+    One figure is made up front and every frame only moves its artists, the
+    positions of a round come straight from the trace instead of walking
+    every car's courses, so rendering all frames is linear in the run length.
+
+    :param trace: TraceFile
+        Trace of the run
+    :param size: (int, int)
+        Size of the map, e.g. sim.config.size
+    """
+
+    def __init__(self, trace: TraceFile, size: (int, int)) -> None:
+        self.trace: TraceFile = trace
+        self.size: np.ndarray = np.array(size)
+        x_max, y_max = size
+        self.fig = plt.figure(figsize=fig_size)
+        self.axi = self.fig.add_subplot(1, 1, 1, xlim=[0, x_max], ylim=[0, y_max])
+        self.axi.set_xticks(np.arange(0, x_max + 1, 5))
+        self.axi.set_yticks(np.arange(0, y_max + 1, 5))
+        self.axi.grid(True)
+        self.source = trace.courses(0) % self.size
+        self.trail, = self.axi.plot([], [], "bo", markersize=4)
+        self.cars = self.axi.scatter(np.zeros(trace.num_of_cars), np.zeros(trace.num_of_cars), s=64, zorder=3)
+        self.title = self.axi.set_title("")
+        self.fig.tight_layout()
+
+    def draw(self, rd: int) -> list:
+        self.title.set_text(f"at round {rd}")
+        self.trail.set_data(*self.source[:rd + 1].T)
+        self.cars.set_offsets(self.trace.positions(rd) % self.size)
+        self.cars.set_color(np.where(self.trace.informed(rd), "g", "r"))
+        return [self.title, self.trail, self.cars]
+
+    def save_frames(self, directory: str, rounds=None) -> None:
+        """Write `directory`/<round>.png for every round (or the given ones)"""
+        for rd in range(len(self.trace)) if rounds is None else rounds:
+            self.draw(rd)
+            self.fig.savefig(os.path.join(directory, f"{rd}.png"))
+
+    def save_animation(self, path: str, fps: int = 10) -> None:
+        """Write every round into one file, a .gif with Pillow, anything else with ffmpeg"""
+        writer = PillowWriter(fps=fps) if path.endswith(".gif") else FFMpegWriter(fps=fps)
+        FuncAnimation(self.fig, self.draw, frames=len(self.trace)).save(path, writer=writer)
+
+    def close(self) -> None:
+        plt.close(self.fig)
+
+
+def render_rounds(task: (str, (int, int), str, range)) -> None:
+    path, size, directory, rounds = task
+    with TraceFile(path) as trace:
+        gui = GUIAnimation(trace, size)
+        gui.save_frames(directory, rounds)
+        gui.close()
+
+
+def render_frames(path: str, size: (int, int), directory: str, processes: int = None) -> None:
+    """Write the frame of every round of the trace at `path`, split over `processes` worker processes"""
+    with TraceFile(path) as trace:
+        rounds = len(trace)
+    processes = processes or mp.cpu_count()
+    bounds = np.cumsum([0] + split_evenly(rounds, processes))
+    tasks = [(path, size, directory, range(lo, hi)) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+    if processes == 1:
+        for task in tasks:
+            render_rounds(task)
+        return
+    with mp.Pool(processes) as pool:
+        pool.map(render_rounds, tasks)